@@ -1,7 +1,29 @@
 'An ordered dictionary with attribute-style access.'
 
+import sys
+import math
+import time
+import threading
+import collections
+try:
+    import copyreg
+except ImportError:
+    import copy_reg as copyreg
+from copy import copy as _copy, deepcopy
+from operator import eq as _eq
+try:
+    from reprlib import recursive_repr as _recursive_repr
+except ImportError:
+    # Python 2. Only DictAttrDict uses this, and it's replaced by AttrDict there
+    def _recursive_repr(fillvalue='...'):
+        return lambda func: func
 from collections import OrderedDict, Counter, defaultdict
 
+try:
+    from collections.abc import Mapping, MutableMapping, KeysView, ItemsView, ValuesView
+except ImportError:
+    from collections import Mapping, MutableMapping, KeysView, ItemsView, ValuesView
+
 # Python 3.5 does not allow inheriting from both OrderedDict and defaultdict.
 # So we replace the default C implementation of OrderedDict with a pure Python
 # version that's available in Python 3.5.
@@ -12,6 +34,26 @@ try:
 except TypeError:
     from .ordereddict import OrderedDict
 
+# Python 2 paths may be str or unicode
+try:
+    _STRING_TYPES = basestring
+except NameError:
+    _STRING_TYPES = str
+
+# Python 2.7's OrderedDict has no move_to_end(). Delete and re-insert the key
+if hasattr(collections.OrderedDict, 'move_to_end'):
+    def _move_to_end(od, key):
+        od.move_to_end(key)
+else:
+    def _move_to_end(od, key):
+        value = dict.__getitem__(od, key)
+        collections.OrderedDict.__delitem__(od, key)
+        collections.OrderedDict.__setitem__(od, key, value)
+
+# Attributes with these prefixes are never looked up as keys. Most keys don't
+# start with "_", so checking the first character skips the startswith() call.
+_PRIVATE = ('__', '_OrderedDict__')
+
 
 class AttrDict(OrderedDict):
     '''
@@ -23,8 +65,7 @@ class AttrDict(OrderedDict):
 
     def __getattr__(self, name):
         '''Getting ad.x gets ad["x"]'''
-        if (name.startswith('__') or name.startswith('_OrderedDict__') or
-                name in self.__exclude_keys__):
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name in self.__exclude_keys__:
             return super(AttrDict, self).__getattr__(name)
         else:
             try:
@@ -34,15 +75,13 @@ class AttrDict(OrderedDict):
 
     def __setattr__(self, name, value):
         '''Setting ad.x sets ad["x"]'''
-        if (name.startswith('__') or name.startswith('_OrderedDict__') or
-                name in self.__exclude_keys__):
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name in self.__exclude_keys__:
             return super(AttrDict, self).__setattr__(name, value)
         self[name] = value
 
     def __delattr__(self, name):
         '''Deleting ad.x deletes ad["x"]'''
-        if (name.startswith('__') or name.startswith('_OrderedDict__') or
-                name in self.__exclude_keys__):
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name in self.__exclude_keys__:
             return super(AttrDict, self).__delattr__(name)
         del self[name]
 
@@ -50,30 +89,1604 @@ class AttrDict(OrderedDict):
         '''Print like a dict that is human readable'''
         return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
 
+    @classmethod
+    def from_pairs(cls, pairs):
+        '''Create an AttrDict from an iterable of (key, value) pairs'''
+        return cls(pairs)
+
+    @classmethod
+    def from_rows(cls, keys, rows):
+        '''
+        Lazily yield an AttrDict for each row in rows, mapping keys to the row's
+        values. This is faster than creating each AttrDict separately.
+
+        >>> cursor.execute('SELECT id, name FROM users')
+        >>> keys = [col[0] for col in cursor.description]
+        >>> users = list(AttrDict.from_rows(keys, cursor))
+        '''
+        keys = tuple(keys)
+        if len(set(keys)) != len(keys):
+            raise ValueError('keys must be unique: %r' % (keys, ))
+        # The pure Python OrderedDict can copy one key layout across rows
+        if (hasattr(cls, '_from_rows') and cls.__init__ is OrderedDict.__init__ and
+                cls.__setitem__ is OrderedDict.__setitem__):
+            return cls._from_rows(keys, rows)
+        return (cls(zip(keys, row)) for row in rows)
+
+    def __reduce_ex__(self, protocol):
+        '''
+        Pickle as lists of keys and values, which unpickle in bulk. Keys and
+        values are pickled as state, after the object, so cycles are allowed.
+        '''
+        extra = {key: val for key, val in self.__dict__.items()
+                 if not key.startswith('_OrderedDict__')}
+        return copyreg.__newobj__, (type(self), ), (list(self), list(self.values()), extra)
+
+    def __setstate__(self, state):
+        keys, values, extra = state[:3]
+        OrderedDict.__init__(self)
+        self.__dict__.update(extra)
+        OrderedDict.update(self, zip(keys, values))
+
+    def snapshot(self):
+        '''
+        Return a copy-on-write copy. Nested AttrDicts are shared with the
+        original until they're first accessed via the copy, when they're
+        snapshotted too. So the cost depends on the nodes accessed, not on the
+        size of the tree. Other mutable values, like lists, are shared.
+
+        Don't change the original while using the snapshot. Changes to nested
+        AttrDicts not yet accessed via the snapshot will show up in it.
+        '''
+        cls = _copy_on_write(type(self))
+        snap = cls.__new__(cls)
+        OrderedDict.__init__(snap)
+        if isinstance(self, defaultdict):
+            defaultdict.__init__(snap, self.default_factory)
+        shared = snap.__dict__['__shared__'] = set()
+        for key in self:
+            # Read raw values. If self is a snapshot, share its shared values too
+            value = dict.__getitem__(self, key)
+            OrderedDict.__setitem__(snap, key, value)
+            if isinstance(value, AttrDict):
+                shared.add(key)
+        return snap
+
 
 class CounterAttrDict(AttrDict, Counter):
     '''
     A Counter with ordered keys and attribute-style access
     '''
+    # Defined once per class. Changing a set per instance would leak the names
+    # into AttrDict, which shares the set
+    __exclude_keys__ = frozenset({'most_common', 'elements', 'subtract'})
+
     def __init__(self, *args, **kwargs):
         super(AttrDict, self).__init__(*args, **kwargs)
         super(Counter, self).__init__(*args, **kwargs)
-        self.__exclude_keys__ |= {'most_common', 'elements', 'subtract'}
 
 
 class DefaultAttrDict(AttrDict, defaultdict):
     '''
     A defaultdict with ordered keys and attribute-style access.
     '''
+    __exclude_keys__ = frozenset({'default_factory', '_ipython_display_'})
+
     def __init__(self, default_factory, *args, **kwargs):
-        super(AttrDict, self).__init__(*args, **kwargs)
+        OrderedDict.__init__(self, *args, **kwargs)
         defaultdict.__init__(self, default_factory)
-        self.__exclude_keys__ |= {'default_factory', '_ipython_display_'}
+
+    def __reduce_ex__(self, protocol):
+        '''Pickle like AttrDict, adding the default_factory to the state'''
+        func, args, state = super(DefaultAttrDict, self).__reduce_ex__(protocol)
+        return func, args, state + (self.default_factory, )
+
+    def __setstate__(self, state):
+        defaultdict.__init__(self, state[3])
+        super(DefaultAttrDict, self).__setstate__(state)
+
+
+_MISSING = object()
+
+
+def _path_keys(path, sep):
+    '''Split a path like "a.b.c" into keys. Lists and tuples are used as-is'''
+    return path.split(sep) if isinstance(path, _STRING_TYPES) else path
 
 
 class Tree(DefaultAttrDict):
     '''
     A tree structure that lets you set attributes at any level.
+
+    Paths are strings like "a.b.c", or lists of keys like ["a", "b", "c"].
+    '''
+    def __init__(self, *args, **kwargs):
+        # Called for every node created, so skip DefaultAttrDict.__init__
+        OrderedDict.__init__(self, *args, **kwargs)
+        defaultdict.__init__(self, Tree)
+
+    def get_path(self, path, default=None, sep='.'):
+        '''
+        Return the value at path, or default if it's missing. Unlike tree.a.b.c,
+        this does not create missing nodes.
+        '''
+        node = self
+        for key in _path_keys(path, sep):
+            # Snapshots copy shared values, and LazyAttrDicts load values, in
+            # __getitem__. Check the key first, so nothing is created
+            if isinstance(node, (_CopyOnWrite, LazyAttrDict)):
+                node = node[key] if key in node else _MISSING
+            # dict.get skips defaultdict.__missing__, so nothing is created
+            elif isinstance(node, dict):
+                node = dict.get(node, key, _MISSING)
+            elif isinstance(node, Mapping):
+                node = node.get(key, _MISSING)
+            else:
+                return default
+            if node is _MISSING:
+                return default
+        return node
+
+    def set_path(self, path, value, sep='.'):
+        '''Set the value at path, creating missing nodes'''
+        keys = _path_keys(path, sep)
+        self._node(keys[:-1])[keys[-1]] = value
+
+    def update_paths(self, paths, sep='.'):
+        '''
+        Set values at many paths, from a mapping or iterable of (path, value).
+        Parent nodes are looked up once for paths with the same parent.
+        '''
+        parents = {}
+        for path, value in (paths.items() if isinstance(paths, Mapping) else paths):
+            keys = tuple(_path_keys(path, sep))
+            parent_keys, key = keys[:-1], keys[-1]
+            node = parents.get(parent_keys)
+            if node is None:
+                node = parents[parent_keys] = self._node(parent_keys)
+            # Replacing a subtree detaches cached nodes under it
+            if isinstance(node, dict) and isinstance(dict.get(node, key), Mapping):
+                parents.clear()
+            node[key] = value
+
+    def _node(self, keys):
+        '''Return the node at keys, creating missing nodes'''
+        node = self
+        for key in keys:
+            if key not in node:
+                node[key] = self.__class__()
+            node = node[key]
+        return node
+
+
+class _CopyOnWrite(object):
+    '''
+    Mixin for AttrDict.snapshot(). The AttrDict values of keys in __shared__
+    belong to the original. Reading one replaces it with its snapshot.
+    '''
+    def __init__(self, *args, **kwargs):
+        # Instances not made by snapshot(), e.g. via copy() or new Tree nodes,
+        # share nothing
+        self.__dict__['__shared__'] = set()
+        super(_CopyOnWrite, self).__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = super(_CopyOnWrite, self).__getitem__(key)
+        shared = self.__shared__
+        if key in shared:
+            shared.discard(key)
+            value = value.snapshot()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.__shared__.discard(key)
+        super(_CopyOnWrite, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.__shared__.discard(key)
+        super(_CopyOnWrite, self).__delitem__(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def popitem(self, last=True):
+        key, value = super(_CopyOnWrite, self).popitem(last)
+        if key in self.__shared__:
+            self.__shared__.discard(key)
+            value = value.snapshot()
+        return key, value
+
+    def __reduce_ex__(self, protocol):
+        # Pickle as the original class, since the snapshot class is dynamic
+        func, args, state = super(_CopyOnWrite, self).__reduce_ex__(protocol)
+        state[2].pop('__shared__', None)
+        return _new_instance, (self.__class__.__bases__[1], ), state
+
+
+def _new_instance(cls):
+    '''Create an uninitialized instance of cls, e.g. when unpickling'''
+    return cls.__new__(cls)
+
+
+_copy_on_write_classes = {}
+
+
+def _copy_on_write(cls):
+    '''Return a subclass of cls (with the same name) for cls.snapshot()'''
+    if issubclass(cls, _CopyOnWrite):
+        return cls
+    if cls not in _copy_on_write_classes:
+        _copy_on_write_classes[cls] = type(cls.__name__, (_CopyOnWrite, cls), {})
+    return _copy_on_write_classes[cls]
+
+
+class _Striped(object):
+    '''
+    Mixin for thread-safe AttrDicts. Each key is guarded by one of __stripes__
+    locks, so threads updating different keys rarely wait for the same lock.
+    Adding, removing or reordering keys also takes one shared lock, since it
+    changes the key order. Locks are taken in that order: a key's lock, then
+    the shared lock. popitem() and clear() take every key's lock.
+    '''
+    __stripes__ = 16
+
+    def __init__(self, *args, **kwargs):
+        self._init_locks()
+        super(_Striped, self).__init__(*args, **kwargs)
+
+    def _init_locks(self):
+        state = self.__dict__
+        state['__locks__'] = [threading.RLock() for _ in range(self.__stripes__)]
+        state['__lock__'] = threading.RLock()
+
+    def locked(self, key):
+        '''
+        Return the lock for key, to update it atomically. Don't nest these.
+
+        >>> with ad.locked('x'):
+        ...     ad.x += 1
+        '''
+        locks = self.__locks__
+        return locks[hash(key) % len(locks)]
+
+    def add(self, key, amount=1):
+        '''Atomically add amount to ad[key] and return the new value'''
+        locks = self.__locks__
+        with locks[hash(key) % len(locks)]:
+            value = dict.get(self, key, _MISSING)
+            if value is _MISSING:
+                value = self[key] + amount
+                self[key] = value
+            else:
+                # Existing keys keep their position. Skip the ordering logic.
+                # Deletes take this key's lock, so the key is still here
+                value += amount
+                dict.__setitem__(self, key, value)
+        return value
+
+    def _lock_all(self):
+        '''Acquire every key's lock. Release them with _unlock_all()'''
+        for lock in self.__locks__:
+            lock.acquire()
+
+    def _unlock_all(self):
+        for lock in reversed(self.__locks__):
+            lock.release()
+
+    def __setitem__(self, key, value):
+        locks = self.__locks__
+        with locks[hash(key) % len(locks)]:
+            if key in self:
+                dict.__setitem__(self, key, value)
+            else:
+                with self.__lock__:
+                    super(_Striped, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        locks = self.__locks__
+        with locks[hash(key) % len(locks)], self.__lock__:
+            super(_Striped, self).__delitem__(key)
+
+    def __iter__(self):
+        # Copy the keys, so that other threads can change them while iterating
+        with self.__lock__:
+            return iter(list(super(_Striped, self).__iter__()))
+
+    def __reversed__(self):
+        with self.__lock__:
+            return iter(list(super(_Striped, self).__reversed__()))
+
+    def setdefault(self, key, default=None):
+        locks = self.__locks__
+        with locks[hash(key) % len(locks)], self.__lock__:
+            return super(_Striped, self).setdefault(key, default)
+
+    def pop(self, key, *args):
+        locks = self.__locks__
+        with locks[hash(key) % len(locks)], self.__lock__:
+            return super(_Striped, self).pop(key, *args)
+
+    def popitem(self, last=True):
+        # The key isn't known in advance, so take every key's lock
+        self._lock_all()
+        try:
+            with self.__lock__:
+                return super(_Striped, self).popitem(last)
+        finally:
+            self._unlock_all()
+
+    def move_to_end(self, key, last=True):
+        with self.__lock__:
+            return super(_Striped, self).move_to_end(key, last)
+
+    def clear(self):
+        self._lock_all()
+        try:
+            with self.__lock__:
+                return super(_Striped, self).clear()
+        finally:
+            self._unlock_all()
+
+    def __reduce_ex__(self, protocol):
+        # Locks can't be pickled. __setstate__ creates new ones
+        func, args, state = super(_Striped, self).__reduce_ex__(protocol)
+        state[2].pop('__locks__', None)
+        state[2].pop('__lock__', None)
+        return func, args, state
+
+    def __setstate__(self, state):
+        self._init_locks()
+        super(_Striped, self).__setstate__(state)
+
+
+class ConcurrentCounterAttrDict(_Striped, CounterAttrDict):
+    '''
+    A thread-safe CounterAttrDict with lock-striped updates. ``ad.x += 1`` is
+    not atomic. Use ``ad.add('x')``, or ``with ad.locked('x'): ad.x += 1``.
+    '''
+
+
+class ConcurrentDefaultAttrDict(_Striped, DefaultAttrDict):
+    '''
+    A thread-safe DefaultAttrDict with lock-striped updates. Missing keys are
+    created once, even if many threads read them at the same time. ``ad.x += 1``
+    is not atomic. Use ``ad.add('x')``, or ``with ad.locked('x'): ad.x += 1``.
+    '''
+    def __missing__(self, key):
+        locks = self.__locks__
+        with locks[hash(key) % len(locks)], self.__lock__:
+            if key in self:
+                return dict.__getitem__(self, key)
+            return super(ConcurrentDefaultAttrDict, self).__missing__(key)
+
+
+class _RawItemsView(ItemsView):
+    '''An items view that reads values without calling __getitem__'''
+    def __iter__(self):
+        mapping = self._mapping
+        for key in mapping:
+            yield key, dict.__getitem__(mapping, key)
+
+
+class _RawValuesView(ValuesView):
+    '''A values view that reads values without calling __getitem__'''
+    def __iter__(self):
+        mapping = self._mapping
+        for key in mapping:
+            yield dict.__getitem__(mapping, key)
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'expirations', 'maxsize', 'currsize'])
+
+
+class LRUAttrDict(AttrDict):
+    '''
+    An AttrDict that holds at most maxsize items, dropping the least recently
+    used item when full. Reading or setting a key moves it to the end, so keys
+    are in least to most recently used order. maxsize=None means no limit.
+
+    Reads reorder keys, so even reads need a lock across threads. With
+    approximate=True, reads just mark the key as used (a lock-free set.add).
+    Eviction then skips marked keys once, unmarking them (the CLOCK algorithm).
+
+    >>> cache = LRUAttrDict(maxsize=1000)
+    >>> cache.user = fetch_user()
+    >>> cache.cache_info()
+    CacheInfo(hits=0, misses=0, evictions=0, expirations=0, maxsize=1000, currsize=1)
+
+    Iterating over keys, values or items does not count as a use.
+    '''
+    def __init__(self, maxsize=128, *args, **kwargs):
+        approximate = kwargs.pop('approximate', False)
+        state = self.__dict__
+        state['__maxsize__'] = maxsize
+        # hits, misses, evictions, expirations
+        state['__stats__'] = [0, 0, 0, 0]
+        state['__used__'] = set() if approximate else None
+        super(LRUAttrDict, self).__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        try:
+            value = dict.__getitem__(self, key)
+        except KeyError:
+            self.__stats__[1] += 1
+            raise
+        self.__stats__[0] += 1
+        used = self.__used__
+        if used is None:
+            _move_to_end(self, key)
+        else:
+            used.add(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        self.__stats__[1] += 1
+        return default
+
+    def __setitem__(self, key, value):
+        if key in self:
+            dict.__setitem__(self, key, value)
+            _move_to_end(self, key)
+        else:
+            super(LRUAttrDict, self).__setitem__(key, value)
+            maxsize = self.__maxsize__
+            if maxsize is not None and len(self) > maxsize:
+                self._evict(maxsize)
+
+    def _evict(self, maxsize):
+        '''Drop the least recently used items until there are maxsize items'''
+        used, stats = self.__used__, self.__stats__
+        while len(self) > maxsize:
+            if used:
+                # Give keys marked as used a second chance
+                key = next(OrderedDict.__iter__(self))
+                if key in used:
+                    used.discard(key)
+                    _move_to_end(self, key)
+                    continue
+            self.popitem(last=False)
+            stats[2] += 1
+
+    def __delitem__(self, key):
+        super(LRUAttrDict, self).__delitem__(key)
+        if self.__used__:
+            self.__used__.discard(key)
+
+    def pop(self, key, *args):
+        if key in self:
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        if args:
+            return args[0]
+        raise KeyError(key)
+
+    def popitem(self, last=True):
+        key, value = super(LRUAttrDict, self).popitem(last)
+        if self.__used__:
+            self.__used__.discard(key)
+        return key, value
+
+    def clear(self):
+        super(LRUAttrDict, self).clear()
+        if self.__used__:
+            self.__used__.clear()
+
+    def items(self):
+        return _RawItemsView(self)
+
+    def values(self):
+        return _RawValuesView(self)
+
+    def copy(self):
+        return _copy(self)
+
+    def cache_info(self):
+        '''Return the number of hits, misses, evictions, etc.'''
+        return CacheInfo(*(self.__stats__ + [self.__maxsize__, len(self)]))
+
+    def __setstate__(self, state):
+        # copy.copy() passes the original's state. Don't share stats and marks
+        extra = state[2]
+        extra['__stats__'] = list(extra['__stats__'])
+        if extra['__used__'] is not None:
+            extra['__used__'] = set(extra['__used__'])
+        super(LRUAttrDict, self).__setstate__(state)
+
+
+class TTLAttrDict(LRUAttrDict):
+    '''
+    An LRUAttrDict whose items expire ttl seconds after they're set. Expired
+    items are dropped when they're read, when an item is set, or on expire().
+    len() may count expired items until then.
+
+    >>> cache = TTLAttrDict(ttl=60, maxsize=1000)
+    >>> cache.token = get_token()
+
+    Copies and unpickled TTLAttrDicts restart the TTL of their items.
+    '''
+    __timer__ = staticmethod(getattr(time, 'monotonic', time.time))
+
+    def __init__(self, ttl, maxsize=None, *args, **kwargs):
+        state = self.__dict__
+        state['__ttl__'] = ttl
+        # Keys ordered by expiry time. Setting a key moves it to the end
+        state['__expires__'] = collections.OrderedDict()
+        super(TTLAttrDict, self).__init__(maxsize, *args, **kwargs)
+
+    def expire(self):
+        '''Drop all expired items'''
+        expires, now = self.__expires__, self.__timer__()
+        while expires:
+            key = next(iter(expires))
+            if expires[key] > now:
+                break
+            del self[key]
+            self.__stats__[3] += 1
+
+    def _expired(self, key):
+        '''Drop key if it has expired, and return True if it was dropped'''
+        expiry = self.__expires__.get(key)
+        if expiry is not None and expiry <= self.__timer__():
+            del self[key]
+            self.__stats__[3] += 1
+            return True
+        return False
+
+    def __getitem__(self, key):
+        self._expired(key)
+        return super(TTLAttrDict, self).__getitem__(key)
+
+    def __contains__(self, key):
+        return not self._expired(key) and dict.__contains__(self, key)
+
+    def __iter__(self):
+        self.expire()
+        return super(TTLAttrDict, self).__iter__()
+
+    def __setitem__(self, key, value):
+        self.expire()
+        expires = self.__expires__
+        expires[key] = self.__timer__() + self.__ttl__
+        _move_to_end(expires, key)
+        super(TTLAttrDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super(TTLAttrDict, self).__delitem__(key)
+        self.__expires__.pop(key, None)
+
+    def popitem(self, last=True):
+        key, value = super(TTLAttrDict, self).popitem(last)
+        self.__expires__.pop(key, None)
+        return key, value
+
+    def clear(self):
+        super(TTLAttrDict, self).clear()
+        self.__expires__.clear()
+
+    def __setstate__(self, state):
+        # Expiry times are from this process' clock. Items are set again instead
+        state[2]['__expires__'] = collections.OrderedDict()
+        super(TTLAttrDict, self).__setstate__(state)
+
+
+class _Lazy(object):
+    '''A LazyAttrDict value that's loaded by calling func(*args) on first access'''
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func, self.args = func, args
+
+    def load(self):
+        return self.func(*self.args)
+
+    # Only code that reads raw dict values, like collections.OrderedDict.__eq__,
+    # sees a _Lazy. Compare its loaded value, but don't cache it
+    def __eq__(self, other):
+        return self.load() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class LazyAttrDict(AttrDict):
+    '''
+    An AttrDict whose values may be loaded on first access, e.g. via
+    jsonutils.lazy_loads() or yamlutils.LazyAttrDictYAMLLoader. Nested mappings
+    and lists are only converted when they're read, so a large document where
+    only a few keys are used loads much faster.
+
+    Order and the AttrDict API are preserved. Iterating over values or items,
+    comparing and pickling load the values they touch.
+    '''
+    def __getitem__(self, key):
+        value = super(LazyAttrDict, self).__getitem__(key)
+        if type(value) is _Lazy:
+            value = value.load()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *args):
+        value = super(LazyAttrDict, self).pop(key, *args)
+        return value.load() if type(value) is _Lazy else value
+
+    def popitem(self, last=True):
+        key, value = super(LazyAttrDict, self).popitem(last)
+        return key, value.load() if type(value) is _Lazy else value
+
+    def __eq__(self, other):
+        for key in self:
+            self[key]
+        return super(LazyAttrDict, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+# Marks an unused slot in _KeyIndex.keys
+_EMPTY = object()
+
+
+class _KeyIndex(object):
+    '''
+    Keys in order, with O(log n) lookup by position. Keys live in slots
+    [start, end) of a list, with room on both sides to add keys to either end.
+    A deleted key leaves an _EMPTY slot. A Fenwick tree (binary indexed tree)
+    counts the keys in slots, so the position of a slot, and the slot at a
+    position, take O(log n). When the list is full, or mostly empty slots, it's
+    rebuilt in O(n). That happens once every O(n) changes.
+    '''
+    __slots__ = ('keys', 'slot', 'tree', 'start', 'end')
+
+    def __init__(self, keys=()):
+        self.rebuild(list(keys))
+
+    def rebuild(self, keys):
+        '''Lay out keys in the middle of a list with equal room on both sides'''
+        size = len(keys)
+        capacity = 2 * size + 16
+        self.start = start = (capacity - size) // 2
+        self.end = start + size
+        self.keys = [_EMPTY] * start + keys + [_EMPTY] * (capacity - start - size)
+        self.slot = dict(zip(keys, range(start, start + size)))
+        # tree[i] counts the keys in slots [i - (i & -i), i). Keys fill slots
+        # [start, end), so that's i & -i inside it, and 0 outside it...
+        end = self.end
+        tree = self.tree = ([0] * (start + 1) + [i & -i for i in range(start + 1, end + 1)] +
+                            [0] * (capacity - end))
+        # ... except for the O(log n) nodes that cover slot start - 1 or slot end
+        for i in (start, end + 1):
+            while 0 < i <= capacity:
+                tree[i] = max(0, min(i, end) - max(i - (i & -i), start))
+                i += i & -i
+
+    def __len__(self):
+        return len(self.slot)
+
+    def _add(self, slot, delta):
+        tree = self.tree
+        size = len(tree)
+        slot += 1
+        while slot < size:
+            tree[slot] += delta
+            slot += slot & -slot
+
+    def append(self, key):
+        if self.end == len(self.keys):
+            self.rebuild(list(self))
+        end = self.end
+        self.keys[end] = key
+        self.slot[key] = end
+        self._add(end, 1)
+        self.end = end + 1
+
+    def appendleft(self, key):
+        if self.start == 0:
+            self.rebuild(list(self))
+        start = self.start = self.start - 1
+        self.keys[start] = key
+        self.slot[key] = start
+        self._add(start, 1)
+
+    def remove(self, key):
+        slot = self.slot.pop(key)
+        keys = self.keys
+        keys[slot] = _EMPTY
+        self._add(slot, -1)
+        # Keep keys at both ends, so that first and last are O(1)
+        start, end = self.start, self.end
+        while start < end and keys[start] is _EMPTY:
+            start += 1
+        while end > start and keys[end - 1] is _EMPTY:
+            end -= 1
+        self.start, self.end = start, end
+        if end - start > 2 * len(self.slot) + 16:
+            self.rebuild(list(self))
+
+    def index(self, key):
+        '''Return the position of key. Raises KeyError if key is missing'''
+        slot, tree, pos = self.slot[key], self.tree, 0
+        while slot > 0:
+            pos += tree[slot]
+            slot -= slot & -slot
+        return pos
+
+    def at(self, pos):
+        '''Return the key at position pos, where 0 <= pos < len(self)'''
+        tree, slot = self.tree, 0
+        step = 1 << (len(tree) - 1).bit_length()
+        # Find the largest slot with at most pos keys before it
+        while step:
+            nxt = slot + step
+            if nxt < len(tree) and tree[nxt] <= pos:
+                slot, pos = nxt, pos - tree[nxt]
+            step >>= 1
+        return self.keys[slot]
+
+    def islice(self, pos, count):
+        '''Yield count keys (or fewer) from position pos onwards'''
+        keys, slot, end = self.keys, self.slot[self.at(pos)], self.end
+        while count > 0 and slot < end:
+            key = keys[slot]
+            if key is not _EMPTY:
+                yield key
+                count -= 1
+            slot += 1
+
+    def ireverse(self, pos, count):
+        '''Yield count keys (or fewer) from position pos backwards'''
+        keys, slot, start = self.keys, self.slot[self.at(pos)], self.start
+        while count > 0 and slot >= start:
+            key = keys[slot]
+            if key is not _EMPTY:
+                yield key
+                count -= 1
+            slot -= 1
+
+    def __iter__(self):
+        for key in self.keys[self.start:self.end]:
+            if key is not _EMPTY:
+                yield key
+
+    def __reversed__(self):
+        keys = self.keys
+        for slot in range(self.end - 1, self.start - 1, -1):
+            key = keys[slot]
+            if key is not _EMPTY:
+                yield key
+
+
+class IndexedAttrDict(AttrDict):
+    '''
+    An AttrDict with fast positional access. ``ad.at(i)`` returns the i-th key,
+    ``ad.index(key)`` its position, and ``ad.items_slice(start, stop)`` a page
+    of items. These take O(log n) (plus the page size) instead of walking the
+    keys from the start. Setting, deleting and move_to_end() are O(log n).
+
+    >>> ad = IndexedAttrDict((str(i), i) for i in range(100000))
+    >>> ad.at(50000)
+    '50000'
+    >>> ad.items_slice(10, 12)
+    [('10', 10), ('11', 11)]
+    >>> ad.items_slice(0, 2, reverse=True)       # The last page, newest first
+    [('99999', 99999), ('99998', 99998)]
+    '''
+    def __init__(self, *args, **kwargs):
+        self.__dict__['__index__'] = _KeyIndex()
+        super(IndexedAttrDict, self).__init__()
+        self.update(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        # Bulk-load an empty dict in C, and index its keys at once. Python 3.7+
+        # dicts keep insertion order
+        if self or sys.version_info < (3, 7):
+            return super(IndexedAttrDict, self).update(*args, **kwargs)
+        try:
+            dict.update(self, *args, **kwargs)
+        finally:
+            # Index the keys added, even if the input raised an error midway
+            self.__index__.rebuild(list(dict.keys(self)))
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.__index__.append(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.__index__.remove(key)
+
+    def __iter__(self):
+        return iter(self.__index__)
+
+    def __reversed__(self):
+        return reversed(self.__index__)
+
+    def clear(self):
+        dict.clear(self)
+        self.__index__.rebuild([])
+
+    def popitem(self, last=True):
+        if not self:
+            raise KeyError('dictionary is empty')
+        index = self.__index__
+        key = index.keys[index.end - 1 if last else index.start]
+        value = dict.pop(self, key)
+        index.remove(key)
+        return key, value
+
+    def move_to_end(self, key, last=True):
+        index = self.__index__
+        index.remove(key)
+        if last:
+            index.append(key)
+        else:
+            index.appendleft(key)
+
+    def at(self, pos):
+        '''Return the key at position pos. Negative positions count from the end'''
+        size = len(self)
+        if pos < 0:
+            pos += size
+        if not 0 <= pos < size:
+            raise IndexError('position out of range')
+        return self.__index__.at(pos)
+
+    def index(self, key):
+        '''Return the position of key. Raises KeyError if key is missing'''
+        return self.__index__.index(key)
+
+    def items_slice(self, start=None, stop=None, reverse=False):
+        '''
+        Return a list of (key, value) items from position start to stop, like
+        list(ad.items())[start:stop]. With reverse=True, positions count from
+        the last key, and items are in reverse order, like
+        list(reversed(ad.items()))[start:stop]. Use this to page newest first.
+        '''
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return []
+        index = self.__index__
+        if reverse:
+            keys = index.ireverse(len(self) - 1 - start, stop - start)
+        else:
+            keys = index.islice(start, stop - start)
+        getitem = dict.__getitem__
+        return [(key, getitem(self, key)) for key in keys]
+
+    def __reduce_ex__(self, protocol):
+        func, args, state = super(IndexedAttrDict, self).__reduce_ex__(protocol)
+        state[2].pop('__index__', None)
+        return func, args, state
+
+    def __setstate__(self, state):
+        self.__dict__['__index__'] = _KeyIndex()
+        super(IndexedAttrDict, self).__setstate__(state)
+
+    def snapshot(self):
+        snap = super(IndexedAttrDict, self).snapshot()
+        snap.__dict__['__index__'] = _KeyIndex(self)
+        return snap
+
+
+class DictAttrDict(dict):
+    '''
+    DictAttrDict is an AttrDict built on dict instead of OrderedDict.
+
+    Python 3.7+ dicts preserve insertion order, so this skips OrderedDict's
+    per-key bookkeeping. It's faster to build and uses less memory, but
+    move_to_end(key, last=False) is O(n).
+    '''
+    __exclude_keys__ = set()
+
+    def __getattr__(self, name):
+        '''Getting ad.x gets ad["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name in self.__exclude_keys__:
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        '''Setting ad.x sets ad["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name in self.__exclude_keys__:
+            return object.__setattr__(self, name, value)
+        self[name] = value
+
+    def __delattr__(self, name):
+        '''Deleting ad.x deletes ad["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name in self.__exclude_keys__:
+            return object.__delattr__(self, name)
+        del self[name]
+
+    def __reversed__(self):
+        '''ad.__reversed__() <==> reversed(ad)'''
+        return reversed(list(self))
+
+    def move_to_end(self, key, last=True):
+        '''Move an existing element to the end (or beginning if last==False).
+
+        Raises KeyError if the element does not exist.
+        '''
+        value = dict.pop(self, key)
+        if last:
+            dict.__setitem__(self, key, value)
+        else:
+            items = list(self.items())
+            dict.clear(self)
+            dict.__setitem__(self, key, value)
+            dict.update(self, items)
+
+    def popitem(self, last=True):
+        '''ad.popitem() -> (k, v), return and remove a (key, value) pair.
+        Pairs are returned in LIFO order if last is true or FIFO order if false.
+        '''
+        if last:
+            return dict.popitem(self)
+        if not self:
+            raise KeyError('dictionary is empty')
+        key = next(iter(self))
+        return key, dict.pop(self, key)
+
+    def copy(self):
+        '''ad.copy() -> a shallow copy of ad'''
+        return self.__class__(self)
+
+    def __eq__(self, other):
+        '''Comparison to another DictAttrDict is order-sensitive while comparison
+        to other mappings is order-insensitive. Like OrderedDict, which ignores
+        order when compared with a DictAttrDict, so == is symmetric.
+        '''
+        if isinstance(other, DictAttrDict):
+            return dict.__eq__(self, other) and all(map(_eq, self, other))
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce_ex__(self, protocol):
+        '''Pickle like AttrDict, as lists of keys and values'''
+        return copyreg.__newobj__, (type(self), ), (list(self), list(self.values()),
+                                                     dict(self.__dict__))
+
+    def __setstate__(self, state):
+        keys, values, extra = state
+        self.__dict__.update(extra)
+        dict.update(self, zip(keys, values))
+
+    from_pairs = vars(AttrDict)['from_pairs']
+    from_rows = vars(AttrDict)['from_rows']
+
+    @_recursive_repr()
+    def __repr__(self):
+        if not self:
+            return '%s()' % (self.__class__.__name__, )
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def __str__(self):
+        '''Print like a dict that is human readable'''
+        return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
+
+
+# Before Python 3.7, dicts don't preserve order. Fall back to AttrDict.
+if sys.version_info < (3, 7):
+    DictAttrDict = AttrDict    # noqa: F811
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError('%s is read-only' % self.__class__.__name__)
+
+
+class FrozenAttrDict(dict):
     '''
+    A read-only, hashable dict with attribute-style access.
+
+    It's backed by a plain dict with no per-instance __dict__, so it uses much
+    less memory than an AttrDict. Use freeze() to convert nested structures.
+    Before Python 3.7, dicts don't keep order, so it also stores a tuple of keys.
+    '''
+    __slots__ = ('__hash', '__keys')
+
     def __init__(self, *args, **kwargs):
-        super(Tree, self).__init__(Tree, *args, **kwargs)
+        # Calling __init__ again on a live instance would change its contents
+        if hasattr(self, '_FrozenAttrDict__hash'):
+            _readonly(self)
+        if sys.version_info < (3, 7):
+            pairs = collections.OrderedDict(*args, **kwargs)
+            dict.__init__(self, pairs)
+            object.__setattr__(self, '_FrozenAttrDict__keys', tuple(pairs))
+        else:
+            dict.__init__(self, *args, **kwargs)
+        object.__setattr__(self, '_FrozenAttrDict__hash', None)
+
+    if sys.version_info < (3, 7):
+        def __iter__(self):
+            return iter(self.__keys)
+
+        def __reversed__(self):
+            return reversed(self.__keys)
+
+        def keys(self):
+            return KeysView(self)
+
+        def items(self):
+            return ItemsView(self)
+
+        def values(self):
+            return ValuesView(self)
+
+    def __getattr__(self, name):
+        '''Getting fd.x gets fd["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE + ('_FrozenAttrDict__', )):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    __setattr__ = __delattr__ = _readonly
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        if self.__hash is None:
+            object.__setattr__(self, '_FrozenAttrDict__hash', hash(frozenset(self.items())))
+        return self.__hash
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()), )
+
+    def copy(self):
+        '''fd.copy() -> fd, since it's immutable'''
+        return self
+
+    def __repr__(self):
+        if not self:
+            return '%s()' % (self.__class__.__name__, )
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def __str__(self):
+        '''Print like a dict that is human readable'''
+        return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
+
+
+class ChainAttrDict(MutableMapping):
+    '''
+    An attribute-style view over layers of mappings, like collections.ChainMap.
+    Lookups search each layer in order. Writes and deletes go to the first
+    layer. Nothing is copied, so lookups cost the same for any layer size.
+
+    If a key's value is a mapping in several layers, those are chained too.
+    Writes to nested mappings also go to the first layer. If it has no such
+    mapping, e.g. only defaults has db, ``conf.db.port = 1`` adds an AttrDict
+    at first_layer.db. Other layers are never changed.
+
+    >>> conf = ChainAttrDict(tenant, env, defaults)
+    >>> conf.db.host    # tenant.db.host, else env.db.host, else defaults.db.host
+    '''
+    __slots__ = ('maps', '__parent')
+
+    def __init__(self, *maps):
+        object.__setattr__(self, 'maps', list(maps) or [AttrDict()])
+        # (parent chain, key) if maps[0] is a new layer not yet in the parent
+        object.__setattr__(self, '_ChainAttrDict__parent', None)
+
+    def __getitem__(self, key):
+        # Check "in" first. Tree and DefaultAttrDict layers would create keys
+        values = [mapping[key] for mapping in self.maps if key in mapping]
+        if not values:
+            raise KeyError(key)
+        if not isinstance(values[0], Mapping):
+            return values[0]
+        # Chain nested mappings, down to the first layer that isn't a mapping
+        nested = []
+        for value in values:
+            if not isinstance(value, Mapping):
+                break
+            nested.append(value)
+        first = self.maps[0]
+        if key in first and first[key] is nested[0]:
+            return self.__class__(*nested) if len(nested) > 1 else nested[0]
+        # The first layer has no mapping at key. Chain a new one, which is added
+        # to the first layer on the first write
+        chain = self.__class__(AttrDict(), *nested)
+        object.__setattr__(chain, '_ChainAttrDict__parent', (self, key))
+        return chain
+
+    def _first(self):
+        '''Return the first layer, adding it to the parent's first layer if it's new'''
+        if self.__parent is not None:
+            parent, key = self.__parent
+            layer = parent._first()
+            existing = layer[key] if key in layer else None
+            if isinstance(existing, Mapping):
+                # Another view of the same key was written to first. Use it
+                self.maps[0] = existing
+            else:
+                layer[key] = self.maps[0]
+            object.__setattr__(self, '_ChainAttrDict__parent', None)
+        return self.maps[0]
+
+    def __setitem__(self, key, value):
+        self._first()[key] = value
+
+    def __delitem__(self, key):
+        # A new first layer is empty, so this raises a KeyError without adding it
+        del self.maps[0][key]
+
+    def __contains__(self, key):
+        return any(key in mapping for mapping in self.maps)
+
+    def __iter__(self):
+        '''Keys of the last layer first, then new keys from earlier layers'''
+        keys = collections.OrderedDict()
+        for mapping in reversed(self.maps):
+            keys.update(dict.fromkeys(mapping))
+        return iter(keys)
+
+    def __len__(self):
+        return len(set().union(*self.maps))
+
+    def __getattr__(self, name):
+        '''Getting cd.x gets cd["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        '''Setting cd.x sets cd["x"] in the first layer'''
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name == 'maps':
+            return object.__setattr__(self, name, value)
+        self[name] = value
+
+    def __delattr__(self, name):
+        '''Deleting cd.x deletes cd["x"] from the first layer'''
+        if name[:1] == '_' and name.startswith(_PRIVATE) or name == 'maps':
+            return object.__delattr__(self, name)
+        del self[name]
+
+    def new_child(self, mapping=None):
+        '''Return a ChainAttrDict with a new first layer, followed by these'''
+        return self.__class__(AttrDict() if mapping is None else mapping, *self.maps)
+
+    @property
+    def parents(self):
+        '''Return a ChainAttrDict of all layers but the first'''
+        return self.__class__(*self.maps[1:])
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(map(repr, self.maps)))
+
+    def __str__(self):
+        '''Print like a dict that is human readable'''
+        return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
+
+
+def freeze(data):
+    '''
+    Recursively convert mappings into FrozenAttrDict, lists and tuples into
+    tuples, and sets into frozensets. The result is hashable if the leaves are.
+    '''
+    if isinstance(data, FrozenAttrDict):
+        return data
+    if isinstance(data, Mapping):
+        return FrozenAttrDict((key, freeze(val)) for key, val in data.items())
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(val) for val in data)
+    if isinstance(data, (set, frozenset)):
+        return frozenset(freeze(val) for val in data)
+    return data
+
+
+def thaw(data, cls=AttrDict):
+    '''
+    Reverse freeze(). Convert FrozenAttrDict into cls (AttrDict by default, or
+    Tree, etc.) and tuples into lists, recursively.
+    '''
+    if isinstance(data, FrozenAttrDict):
+        return cls((key, thaw(val, cls)) for key, val in data.items())
+    if isinstance(data, tuple):
+        return [thaw(val, cls) for val in data]
+    if isinstance(data, frozenset):
+        return set(thaw(val, cls) for val in data)
+    return data
+
+
+def flatten(data, sep='.'):
+    '''
+    Lazily yield (path, value) for each leaf in nested mappings, depth-first.
+    Paths join keys with sep, e.g. "a.b.c". Non-string keys are converted with
+    str(). Empty mappings are yielded as leaves.
+
+    >>> dict(flatten(Tree(a=Tree(b=1, c=2))))
+    {'a.b': 1, 'a.c': 2}
+    '''
+    # A stack of (path prefix, items iterator) avoids recursion and copies
+    stack = [('', iter(data.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for key, value in items:
+            path = prefix + (key if isinstance(key, _STRING_TYPES) else str(key))
+            if value and isinstance(value, Mapping):
+                stack.append((path + sep, iter(value.items())))
+                break
+            yield path, value
+        else:
+            stack.pop()
+
+
+def unflatten(pairs, cls=Tree, sep='.'):
+    '''
+    Reverse flatten(). Build a cls (Tree by default, or AttrDict, etc.) from a
+    mapping or iterable of (path, value), in one pass.
+
+    >>> unflatten({'a.b': 1, 'a.c': 2})
+    Tree([('a', Tree([('b', 1), ('c', 2)]))])
+    '''
+    result = cls()
+    # Consecutive paths usually share a parent, e.g. from flatten(). Cache it
+    last_keys, last_node = (), result
+    for path, value in (pairs.items() if isinstance(pairs, Mapping) else pairs):
+        keys = path.split(sep)
+        key, parent_keys = keys.pop(), keys
+        if parent_keys != last_keys:
+            node = result
+            for parent_key in parent_keys:
+                if parent_key not in node:
+                    node[parent_key] = cls()
+                node = node[parent_key]
+            last_keys, last_node = parent_keys, node
+        last_node[key] = value
+    return result
+
+
+def _merge_value(old, new, strategy):
+    '''Return the merged value of two non-mapping values for deep_merge()'''
+    if strategy == 'replace':
+        return new
+    if strategy == 'keep':
+        return old
+    if strategy == 'append':
+        return old + new if isinstance(old, list) and isinstance(new, list) else new
+    return strategy(old, new)
+
+
+def _copy_mapping(value):
+    '''Copy mappings inserted by deep_merge() and patch(), so that changing
+    the result later does not change the source'''
+    return deepcopy(value) if isinstance(value, Mapping) else value
+
+
+def deep_merge(a, b, strategy='replace'):
+    '''
+    Recursively merge mapping b into mapping a, in place, and return a. New keys
+    are added at the end. Subtrees that are the same object are skipped.
+
+    When both values are mappings, they're merged. Otherwise, strategy decides:
+
+    - ``'replace'``: use b's value (default)
+    - ``'keep'``: use a's value, i.e. b only adds missing keys
+    - ``'append'``: concatenate lists. Use b's value for other types
+    - a function ``strategy(a_value, b_value)`` that returns the merged value
+
+    Mappings from b are copied into a. Other values, like lists, are shared.
+
+    >>> deep_merge(AttrDict(x=AttrDict(y=1)), {'x': {'z': 2}})
+    AttrDict([('x', AttrDict([('y', 1), ('z', 2)]))])
+    '''
+    if strategy not in ('replace', 'keep', 'append') and not callable(strategy):
+        raise ValueError('strategy= must be "replace", "keep", "append" or a function, '
+                         'not %r' % (strategy, ))
+    stack = [(a, b)]
+    while stack:
+        old, new = stack.pop()
+        for key, new_val in new.items():
+            old_val = old.get(key, _MISSING)
+            if old_val is _MISSING:
+                old[key] = _copy_mapping(new_val)
+            elif old_val is new_val:
+                continue
+            elif isinstance(old_val, MutableMapping) and isinstance(new_val, Mapping):
+                stack.append((old_val, new_val))
+            else:
+                old[key] = _copy_mapping(_merge_value(old_val, new_val, strategy))
+    return a
+
+
+def _same(old, new):
+    '''True if old and new are known to be the same without a full comparison'''
+    if old is new:
+        return True
+    # FrozenAttrDicts cache their hash. If hashes differ, they're not equal
+    if isinstance(old, FrozenAttrDict) and isinstance(new, FrozenAttrDict):
+        try:
+            if hash(old) != hash(new):
+                return False
+        except TypeError:
+            return False
+        return old == new and _same_order(old, new)
+    return False
+
+
+def _same_order(old, new):
+    '''True if the keys of mappings in old and new, which are equal, are in the
+    same order at every level. FrozenAttrDict equality ignores order'''
+    if isinstance(old, Mapping) and isinstance(new, Mapping):
+        return list(old) == list(new) and all(_same_order(old[key], new[key]) for key in old)
+    if isinstance(old, (tuple, list)) and isinstance(new, (tuple, list)):
+        return all(map(_same_order, old, new))
+    return True
+
+
+def diff(a, b):
+    '''
+    Return a list of changes that turn mapping a into b, for use with patch().
+    Each change is a tuple: ``(keys, value)`` sets the value at the path keys (a
+    tuple), and ``(keys, )`` deletes it. Nested mappings are compared
+    recursively. Subtrees that are the same object (or equal FrozenAttrDicts)
+    are skipped without comparing their contents.
+
+    Order is significant. If b reorders the keys of a mapping, other than by
+    deleting keys or adding them at the end, the whole mapping is set.
+
+    >>> diff(AttrDict(x=1, y=AttrDict(z=2)), AttrDict(y=AttrDict(z=3), w=4))
+    [(('x',),), (('w',), 4), (('y', 'z'), 3)]
+    '''
+    delta = []
+    stack = [((), a, b)]
+    while stack:
+        path, old, new = stack.pop()
+        if _same(old, new):
+            continue
+        added = [key for key in new if key not in old]
+        if [key for key in old if key in new] + added != list(new):
+            delta.append((path, new))
+            continue
+        changes = []
+        for key, old_val in old.items():
+            new_val = new.get(key, _MISSING)
+            if new_val is _MISSING:
+                delta.append((path + (key, ), ))
+            elif old_val is new_val:
+                continue
+            elif isinstance(old_val, Mapping) and isinstance(new_val, Mapping):
+                changes.append((path + (key, ), old_val, new_val))
+            elif (type(old_val) is not type(new_val) or old_val != new_val or
+                    not _same_order(old_val, new_val)):
+                delta.append((path + (key, ), new_val))
+        delta.extend((path + (key, ), new[key]) for key in added)
+        # Visit children in order, depth-first
+        stack.extend(reversed(changes))
+    return delta
+
+
+def patch(a, delta):
+    '''
+    Apply changes from diff() to mapping a, in place, and return a. Mappings
+    in the delta are copied into a.
+
+    >>> patch(old, diff(old, new)) == new
+    True
+    '''
+    for change in delta:
+        keys = change[0]
+        if not keys:
+            a.clear()
+            a.update(_copy_mapping(change[1]))
+            continue
+        node = a
+        for key in keys[:-1]:
+            node = node[key]
+        if len(change) == 1:
+            del node[keys[-1]]
+        else:
+            node[keys[-1]] = _copy_mapping(change[1])
+    return a
+
+
+class AttrRecord(Mapping, tuple):
+    '''
+    A read-only row with attribute-style access, created by a RecordSchema.
+
+    It's a tuple of values that shares its keys with all rows of its schema,
+    so it's much smaller than an AttrDict. It behaves like a Mapping: iterating
+    over it yields keys, not values.
+    '''
+    __slots__ = ()
+    _schema = None
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self._schema.index[key])
+
+    def __getattr__(self, name):
+        '''Getting rec.x gets rec["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise TypeError('%s is read-only' % self.__class__.__name__)
+
+    __delattr__ = __setattr__
+
+    def __iter__(self):
+        return iter(self._schema.keys)
+
+    def __reversed__(self):
+        return reversed(self._schema.keys)
+
+    def __contains__(self, key):
+        return key in self._schema.index
+
+    __len__ = tuple.__len__
+
+    def values(self):
+        'Return a tuple of values, in order'
+        return tuple(tuple.__iter__(self))
+
+    def to_attrdict(self, cls=AttrDict):
+        'Convert into an AttrDict (or cls)'
+        return cls(zip(self._schema.keys, tuple.__iter__(self)))
+
+    def __reduce__(self):
+        return self._schema, (tuple(tuple.__iter__(self)), )
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def __str__(self):
+        '''Print like a dict that is human readable'''
+        return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
+
+
+class RecordSchema(object):
+    '''
+    A key layout shared by many rows. Calling it creates an AttrRecord.
+
+    >>> User = RecordSchema(['id', 'name'])
+    >>> user = User([1, 'Alice'])
+    >>> user.name
+    'Alice'
+    >>> users = list(User.from_rows(cursor))
+    '''
+    def __init__(self, keys, name='AttrRecord'):
+        self.keys = tuple(keys)
+        self.index = dict(zip(self.keys, range(len(self.keys))))
+        if len(self.index) != len(self.keys):
+            raise ValueError('keys must be unique: %r' % (self.keys, ))
+        self.name = name
+        self.record = type(name, (AttrRecord, ), {
+            '__slots__': (), '_schema': self, '__module__': __name__})
+
+    def __call__(self, values):
+        '''Create an AttrRecord from a sequence of values, one per key'''
+        record = tuple.__new__(self.record, values)
+        if tuple.__len__(record) != len(self.keys):
+            raise ValueError('expected %d values, got %d' % (
+                len(self.keys), tuple.__len__(record)))
+        return record
+
+    def from_rows(self, rows):
+        '''Lazily yield an AttrRecord for each row in rows'''
+        for row in rows:
+            yield self(row)
+
+    def __reduce__(self):
+        return self.__class__, (self.keys, self.name)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.keys))
+
+
+class Interner(object):
+    '''
+    A table that shares equal keys, and optionally small values, among the
+    mappings of a load. Parsers create a new string for each occurrence of a
+    key. With an Interner, each distinct key is stored once. Pass it to
+    jsonutils.loads(), yamlutils.load(), etc. as ``intern=``.
+
+    >>> table = Interner(values=True)
+    >>> data = jsonutils.loads(text, intern=table)
+    >>> table.hits, table.saved              # Duplicates shared, bytes saved
+    (79946, 3892964)
+
+    Keys that are strings or numbers are shared. With values=True, values that
+    are numbers or strings of up to max_length characters are shared too. Use
+    a new Interner per load (or batch of loads), so the table doesn't grow
+    forever.
+    '''
+    def __init__(self, values=False, max_length=64):
+        self.values = values
+        self.max_length = max_length
+        self.strings = {}
+        # Numbers are keyed by (type, value), so that 1, 1.0 and True differ.
+        # Floats also include the sign, so that -0.0 and 0.0 differ
+        self.numbers = {}
+        self.hits = 0
+        self.saved = 0
+
+    def __len__(self):
+        return len(self.strings) + len(self.numbers)
+
+    def _share(self, table, key, value):
+        shared = table.setdefault(key, value)
+        if shared is not value:
+            self.hits += 1
+            self.saved += sys.getsizeof(value)
+        return shared
+
+    def _number(self, kind, value):
+        if kind is float:
+            return self._share(self.numbers, (kind, value, math.copysign(1, value)), value)
+        return self._share(self.numbers, (kind, value), value)
+
+    def key(self, key):
+        '''Return the shared copy of a key'''
+        kind = type(key)
+        if kind is str:
+            return self._share(self.strings, key, key)
+        if kind is int or kind is float:
+            return self._number(kind, key)
+        return key
+
+    def value(self, value):
+        '''Return the shared copy of a value, if values are interned'''
+        if self.values:
+            kind = type(value)
+            if kind is str and len(value) <= self.max_length:
+                return self._share(self.strings, value, value)
+            if kind is int or kind is float:
+                return self._number(kind, value)
+        return value
+
+    def hook(self, cls=AttrDict):
+        '''Return a json object_pairs_hook that creates cls with shared keys and values'''
+        strings, value, sizeof = self.strings, self.value, sys.getsizeof
+        values, max_length = self.values, self.max_length
+
+        def object_pairs_hook(pairs):
+            # Called per JSON object. Share strings inline, not via key() and value()
+            items = []
+            for key, val in pairs:
+                shared = strings.setdefault(key, key)
+                if shared is not key:
+                    self.hits += 1
+                    self.saved += sizeof(key)
+                    key = shared
+                if values:
+                    if type(val) is str and len(val) <= max_length:
+                        shared = strings.setdefault(val, val)
+                        if shared is not val:
+                            self.hits += 1
+                            self.saved += sizeof(val)
+                            val = shared
+                    else:
+                        val = value(val)
+                items.append((key, val))
+            return cls(items)
+
+        return object_pairs_hook
+
+    def __repr__(self):
+        return '%s(%d items, hits=%d, saved=%d)' % (
+            self.__class__.__name__, len(self), self.hits, self.saved)
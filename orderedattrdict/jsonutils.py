@@ -0,0 +1,88 @@
+'JSON utilities for working with AttrDicts'
+
+import sys
+import json
+from collections import OrderedDict
+from . import AttrDict, LazyAttrDict, _Lazy
+
+# Python 3.7+ dicts keep insertion order, and are the fastest to parse into
+_RAW_HOOK = None if sys.version_info >= (3, 7) else OrderedDict
+
+
+def _hook(cls, intern):
+    '''Return the object_pairs_hook that creates cls, sharing keys via intern'''
+    return cls if intern is None else intern.hook(cls)
+
+
+def loads(s, cls=AttrDict, intern=None, **kwargs):
+    '''Parse a JSON string, loading objects as ordered AttrDict (or cls).
+    intern= is an optional Interner that shares repeated keys and values.
+
+    >>> attrdict = loads('{"x": 1, "y": 2}')
+    '''
+    return json.loads(s, object_pairs_hook=_hook(cls, intern), **kwargs)
+
+
+def load(fp, cls=AttrDict, intern=None, **kwargs):
+    '''Parse a JSON file, loading objects as ordered AttrDict (or cls).
+    intern= is an optional Interner that shares repeated keys and values.
+
+    >>> attrdict = load(open('test.json'))
+    '''
+    return json.load(fp, object_pairs_hook=_hook(cls, intern), **kwargs)
+
+
+def dumps(obj, **kwargs):
+    'Convert AttrDict into a JSON string, preserving order'
+    return json.dumps(obj, **kwargs)
+
+
+def dump(obj, fp, **kwargs):
+    'Write AttrDict into a JSON file, preserving order'
+    return json.dump(obj, fp, **kwargs)
+
+
+def iter_load(fp, cls=AttrDict, intern=None, **kwargs):
+    '''Lazily load a JSON Lines file, one JSON value per line. Blank lines are
+    skipped. Objects load as ordered AttrDict (or cls). json only shares keys
+    within a line. intern= is an optional Interner that shares them across lines.
+
+    >>> for row in iter_load(open('log.jsonl')):
+    ...     print(row.timestamp)
+    '''
+    # Create the decoder once, rather than once per line like json.loads
+    decode = json.JSONDecoder(object_pairs_hook=_hook(cls, intern), **kwargs).decode
+    for line in fp:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line:
+            yield decode(line)
+
+
+def _lazy(value, cls):
+    '''Convert a parsed dict into cls and a list into a list, deferring the
+    conversion of nested dicts and lists until they're accessed'''
+    if isinstance(value, dict):
+        return cls((key, _Lazy(_lazy, val, cls) if isinstance(val, (dict, list)) else val)
+                   for key, val in value.items())
+    if isinstance(value, list):
+        return [_lazy(val, cls) for val in value]
+    return value
+
+
+def lazy_loads(s, cls=LazyAttrDict, **kwargs):
+    '''Parse a JSON string, loading objects as LazyAttrDict (or cls). The JSON is
+    parsed into plain dicts, which are converted into LazyAttrDicts only when
+    they're accessed. This is much faster if only a few keys are used.
+
+    >>> config = lazy_loads(big_json_string)
+    >>> config.servers[0].host      # Only converts config and servers[0]
+    '''
+    kwargs.setdefault('object_pairs_hook', _RAW_HOOK)
+    return _lazy(json.loads(s, **kwargs), cls)
+
+
+def lazy_load(fp, cls=LazyAttrDict, **kwargs):
+    '''Parse a JSON file, loading objects as LazyAttrDict (or cls). See lazy_loads'''
+    return lazy_loads(fp.read(), cls=cls, **kwargs)
@@ -0,0 +1,258 @@
+'''
+NumPy utilities for working with AttrDicts.
+
+ArrayCounterAttrDict is a counter that stores counts in a NumPy int64 array,
+with a key to index dict. Batches of keys are counted with vectorized NumPy
+operations instead of a Python loop per key. This requires NumPy.
+'''
+
+import numpy as np
+from collections import Counter
+from . import CounterAttrDict, _PRIVATE
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+_SLOTS = _PRIVATE + ('_ArrayCounterAttrDict__', )
+
+
+class ArrayCounterAttrDict(Mapping):
+    '''
+    A counter with ordered keys and attribute-style access, backed by a NumPy
+    int64 array. Missing keys count as 0. Use update_many() to count a batch
+    of keys, e.g. a list or array of event names, in one vectorized pass.
+
+    >>> counts = ArrayCounterAttrDict()
+    >>> counts.update_many(['x', 'y', 'x'])
+    >>> counts.x
+    2
+    >>> counts.most_common(1)
+    [('x', 2)]
+    '''
+    __slots__ = ('__keys', '__index', '__counts')
+
+    def __init__(self, data=None, **kwargs):
+        set_slot = object.__setattr__
+        set_slot(self, '_ArrayCounterAttrDict__keys', [])
+        set_slot(self, '_ArrayCounterAttrDict__index', {})
+        set_slot(self, '_ArrayCounterAttrDict__counts', np.zeros(8, dtype=np.int64))
+        self.update(data, **kwargs)
+
+    def _indices(self, keys):
+        '''Return an int array of the indices of keys, adding missing keys'''
+        index, append = self.__index, self.__keys.append
+        indices = np.empty(len(keys), dtype=np.intp)
+        for pos, key in enumerate(keys):
+            i = index.get(key)
+            if i is None:
+                i = index[key] = len(index)
+                append(key)
+            indices[pos] = i
+        size = len(index)
+        if size > len(self.__counts):
+            # Grow geometrically, so adding n keys copies O(n) counts
+            counts = np.zeros(max(size, 2 * len(self.__counts)), dtype=np.int64)
+            counts[:len(self.__counts)] = self.__counts
+            object.__setattr__(self, '_ArrayCounterAttrDict__counts', counts)
+        return indices
+
+    def update_many(self, keys, counts=None):
+        '''
+        Count each key in keys (a list or NumPy array), adding 1 per occurrence,
+        or the matching value in counts. New keys are added in the order they
+        first appear. NumPy int arrays are counted fastest.
+        '''
+        if isinstance(keys, np.ndarray):
+            keys = keys.ravel()
+            if keys.dtype.kind in 'iu' and len(keys):
+                low = int(keys.min())
+                span = int(keys.max()) - low + 1
+                # Integers in a compact range are counted by np.bincount, in C
+                if span <= 4 * len(keys):
+                    return self._update_ints(keys, counts, low, span)
+            keys = keys.tolist()
+        if counts is None:
+            # collections.Counter counts a list of Python objects in C
+            return self.update(Counter(keys))
+        positions = {}
+        offsets = np.fromiter((positions.setdefault(key, len(positions)) for key in keys),
+                              dtype=np.intp, count=len(keys))
+        totals = np.zeros(len(positions), dtype=np.int64)
+        np.add.at(totals, offsets, np.asarray(counts, dtype=np.int64).ravel())
+        indices = self._indices(list(positions))
+        self.__counts[indices] += totals
+
+    def _update_ints(self, keys, counts, low, span):
+        '''Count an int array of keys whose values are in [low, low + span)'''
+        offsets = (keys - low).astype(np.intp)
+        if counts is None:
+            totals = np.bincount(offsets, minlength=span)
+        else:
+            totals = np.zeros(span, dtype=np.int64)
+            np.add.at(totals, offsets, np.asarray(counts, dtype=np.int64).ravel())
+        # Add new keys in the order they first appear
+        first = np.full(span, len(keys), dtype=np.intp)
+        np.minimum.at(first, offsets, np.arange(len(keys)))
+        present = np.flatnonzero(first < len(keys))
+        present = present[np.argsort(first[present], kind='stable')]
+        indices = self._indices((present + low).tolist())
+        self.__counts[indices] += totals[present]
+
+    def update(self, data=None, **kwargs):
+        '''Add counts from a mapping, or count keys from an iterable, like Counter'''
+        if data is not None:
+            if isinstance(data, ArrayCounterAttrDict):
+                indices = self._indices(data.__keys)
+                self.__counts[indices] += data.__counts[:len(data)]
+            elif isinstance(data, Mapping):
+                keys = list(data)
+                indices = self._indices(keys)
+                self.__counts[indices] += np.fromiter(
+                    (data[key] for key in keys), dtype=np.int64, count=len(keys))
+            else:
+                self.update_many(list(data))
+        if kwargs:
+            self.update(kwargs)
+
+    def subtract(self, data=None, **kwargs):
+        '''Subtract counts from a mapping, or count down keys from an iterable'''
+        other = ArrayCounterAttrDict(data, **kwargs)
+        indices = self._indices(other.__keys)
+        self.__counts[indices] -= other.__counts[:len(other)]
+
+    def __getitem__(self, key):
+        i = self.__index.get(key)
+        return 0 if i is None else int(self.__counts[i])
+
+    def __setitem__(self, key, value):
+        # Get the index first, since adding a key may replace the array
+        i = self._indices([key])[0]
+        self.__counts[i] = value
+
+    def __delitem__(self, key):
+        '''Delete a key. This is O(n), since later counts shift down'''
+        i = self.__index.pop(key)
+        del self.__keys[i]
+        size = len(self.__keys)
+        self.__counts[i:size] = self.__counts[i + 1:size + 1]
+        self.__counts[size] = 0
+        index = self.__index
+        for pos in range(i, size):
+            index[self.__keys[pos]] = pos
+
+    def __iter__(self):
+        return iter(self.__keys)
+
+    def __reversed__(self):
+        return reversed(self.__keys)
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def __getattr__(self, name):
+        '''Getting c.x gets c["x"]'''
+        if name[:1] == '_' and name.startswith(_SLOTS):
+            raise AttributeError(name)
+        return self[name]
+
+    def __setattr__(self, name, value):
+        '''Setting c.x sets c["x"]'''
+        if name[:1] == '_' and name.startswith(_SLOTS):
+            return object.__setattr__(self, name, value)
+        self[name] = value
+
+    def __delattr__(self, name):
+        '''Deleting c.x deletes c["x"]'''
+        if name[:1] == '_' and name.startswith(_SLOTS):
+            return object.__delattr__(self, name)
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def array(self):
+        '''A read-only view of the counts as a NumPy array, in key order'''
+        view = self.__counts[:len(self)]
+        view.flags.writeable = False
+        return view
+
+    def total(self):
+        '''Sum of the counts'''
+        return int(self.__counts[:len(self)].sum())
+
+    def most_common(self, n=None):
+        '''
+        List the n most common keys and their counts, most common first. Ties
+        are in insertion order. Uses a partial sort, so small n is fast.
+        '''
+        counts = self.__counts[:len(self)]
+        if n is None or n >= len(counts):
+            top = np.arange(len(counts))
+        elif n <= 0:
+            return []
+        else:
+            # Keep every count above the n-th largest, then the earliest ties
+            # with it. argpartition alone picks ties at the cut-off arbitrarily
+            cutoff = -np.partition(-counts, n - 1)[n - 1]
+            above = np.flatnonzero(counts > cutoff)
+            ties = np.flatnonzero(counts == cutoff)[:n - len(above)]
+            top = np.concatenate((above, ties))
+        # Sort by descending count, then by index
+        top = top[np.lexsort((top, -counts[top]))]
+        keys = self.__keys
+        return [(keys[i], int(counts[i])) for i in top]
+
+    def elements(self):
+        '''Iterate over each key, repeated as many times as its count'''
+        for key, count in zip(self.__keys, self.__counts[:len(self)].tolist()):
+            for _ in range(count):
+                yield key
+
+    def _combine(self, other, sign):
+        '''Return a counter of self + sign * other, keeping positive counts'''
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        result = ArrayCounterAttrDict(self)
+        if sign > 0:
+            result.update(other)
+        else:
+            result.subtract(other)
+        keep = result.__counts[:len(result)] > 0
+        if keep.all():
+            return result
+        positive = ArrayCounterAttrDict()
+        keys = [key for key, flag in zip(result.__keys, keep.tolist()) if flag]
+        indices = positive._indices(keys)
+        positive.__counts[indices] = result.__counts[:len(result)][keep]
+        return positive
+
+    def __add__(self, other):
+        '''Add counts, keeping only positive counts'''
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        '''Subtract counts, keeping only positive counts'''
+        return self._combine(other, -1)
+
+    def copy(self):
+        return ArrayCounterAttrDict(self)
+
+    def to_counter(self, cls=CounterAttrDict):
+        '''Convert into a CounterAttrDict (or cls)'''
+        return cls(zip(self.__keys, self.__counts[:len(self)].tolist()))
+
+    def __reduce__(self):
+        return self.__class__, (dict(zip(self.__keys, self.__counts[:len(self)].tolist())), )
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+    def __str__(self):
+        '''Print like a dict that is human readable'''
+        return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
@@ -1,8 +1,8 @@
 # Pure Python implementation of OrderedDict from the Python 3.5 collections.py
 
 from operator import eq as _eq
+from itertools import islice as _islice
 import sys as _sys
-from _weakref import proxy as _proxy
 from reprlib import recursive_repr as _recursive_repr
 from _collections_abc import KeysView, ItemsView, ValuesView, MutableMapping
 
@@ -28,8 +28,11 @@ class _OrderedDictValuesView(ValuesView):
             yield self._mapping[key]
 
 
-class _Link(object):
-    __slots__ = 'prev', 'next', 'key', '__weakref__'
+# Python 3.7+ dicts preserve insertion order
+_ORDERED_DICT = _sys.version_info >= (3, 7)
+
+# Marks the slot of a deleted key in OrderedDict's order lists
+_DELETED = object()
 
 
 class OrderedDict(dict):
@@ -39,13 +42,17 @@ class OrderedDict(dict):
     # The remaining methods are order-aware.
     # Big-O running times for all methods are the same as regular dictionaries.
 
-    # The internal self.__map dict maps keys to links in a doubly linked list.
-    # The circular doubly linked list starts and ends with a sentinel element.
-    # The sentinel element never gets deleted (this simplifies the algorithm).
-    # The sentinel is in self.__hardroot with a weakref proxy in self.__root.
-    # The prev links are weakref proxies (to prevent circular references).
-    # Individual links are kept alive by the hard reference in self.__map.
-    # Those hard references disappear when a key is deleted from an OrderedDict.
+    # Instead of a linked list of _Link objects, the order is stored in two
+    # lists of keys. self.__tail holds keys in order. self.__head holds keys
+    # before those, in reverse order, so that keys can be added to either end.
+    # self.__pos maps each key to its position: i >= 0 is at self.__tail[i],
+    # and i < 0 is at self.__head[~i].
+    # Deleting a key leaves a _DELETED tombstone in its slot. Tombstones at the
+    # ends of the lists are dropped at once. Tombstones at the start of the
+    # lists are skipped: self.__skip holds the number of slots to skip in the
+    # head and the tail. So the keys at both ends are found in O(1). When
+    # tombstones outnumber keys, the lists are rebuilt, splitting keys evenly.
+    # This keeps every operation O(1) amortized.
 
     def __init__(*args, **kwds):
         '''Initialize an ordered dictionary.  The signature is the same as
@@ -59,65 +66,104 @@ class OrderedDict(dict):
         self, args = args[0], args[1:]
         if len(args) > 1:
             raise TypeError('expected at most 1 arguments, got %d' % len(args))
-        try:
-            self.__root
-        except AttributeError:
-            self.__hardroot = _Link()
-            self.__root = root = _proxy(self.__hardroot)
-            root.prev = root.next = root
-            self.__map = {}
-        self.__update(*args, **kwds)
-
-    def __setitem__(self, key, value,
-                    dict_setitem=dict.__setitem__, proxy=_proxy, Link=_Link):
+        # Use the instance dict directly. Subclasses like AttrDict override
+        # __getattr__ and __setattr__, which makes attribute access slow
+        state = self.__dict__
+        if '_OrderedDict__pos' not in state:
+            state['_OrderedDict__head'] = []
+            state['_OrderedDict__tail'] = []
+            state['_OrderedDict__pos'] = {}
+            state['_OrderedDict__skip'] = [0, 0]
+        # Most instances, e.g. Tree nodes, start empty. Skip update()'s overhead
+        if args or kwds:
+            self.__update(*args, **kwds)
+
+    def __setitem__(self, key, value, dict_setitem=dict.__setitem__):
         'od.__setitem__(i, y) <==> od[i]=y'
-        # Setting a new item creates a new link at the end of the linked list,
+        # Setting a new item appends the key to the tail,
         # and the inherited dictionary is updated with the new key/value pair.
         if key not in self:
-            self.__map[key] = link = Link()
-            root = self.__root
-            last = root.prev
-            link.prev, link.next, link.key = last, root, key
-            last.next = link
-            root.prev = proxy(link)
+            tail = self.__tail
+            self.__pos[key] = len(tail)
+            tail.append(key)
         dict_setitem(self, key, value)
 
     def __delitem__(self, key, dict_delitem=dict.__delitem__):
         'od.__delitem__(y) <==> del od[y]'
-        # Deleting an existing item uses self.__map to find the link which gets
-        # removed by updating the links in the predecessor and successor nodes.
         dict_delitem(self, key)
-        link = self.__map.pop(key)
-        link_prev = link.prev
-        link_next = link.next
-        link_prev.next = link_next
-        link_next.prev = link_prev
-        link.prev = None
-        link.next = None
+        self.__discard(key)
+
+    def __discard(self, key):
+        'Remove key from the order lists. Raises KeyError if key is missing'
+        pos = self.__pos.pop(key)
+        if pos >= 0:
+            side, keys = 1, self.__tail
+        else:
+            side, keys, pos = 0, self.__head, ~pos
+        skip = self.__skip
+        if pos == len(keys) - 1:
+            keys.pop()
+            while keys and keys[-1] is _DELETED:
+                keys.pop()
+            if skip[side] > len(keys):
+                skip[side] = len(keys)
+        else:
+            keys[pos] = _DELETED
+            if pos == skip[side]:
+                # The last key is never a tombstone, so this stops
+                pos += 1
+                while keys[pos] is _DELETED:
+                    pos += 1
+                skip[side] = pos
+            if len(self.__head) + len(self.__tail) > 2 * len(self) + 8:
+                self.__rebuild()
+
+    def __rebuild(self, size=None):
+        '''Drop tombstones. Put the first size keys (default: half) in the head
+        and the rest in the tail'''
+        head, tail = self.__head, self.__tail
+        keys = [key for key in reversed(head) if key is not _DELETED]
+        keys += [key for key in tail if key is not _DELETED]
+        if size is None:
+            size = len(keys) // 2
+        head[:] = reversed(keys[:size])
+        tail[:] = keys[size:]
+        pos = self.__pos
+        pos.clear()
+        pos.update(zip(head, range(-1, -len(head) - 1, -1)))
+        pos.update(zip(tail, range(len(tail))))
+        self.__skip[:] = [0, 0]
 
     def __iter__(self):
         'od.__iter__() <==> iter(od)'
-        # Traverse the linked list in order.
-        root = self.__root
-        curr = root.next
-        while curr is not root:
-            yield curr.key
-            curr = curr.next
+        head, tail = self.__head, self.__tail
+        hskip, tskip = self.__skip
+        for key in _islice(reversed(head), len(head) - hskip):
+            if key is not _DELETED:
+                yield key
+        # Index the tail, since islice would step over the skipped slots
+        for pos in range(tskip, len(tail)):
+            key = tail[pos]
+            if key is not _DELETED:
+                yield key
 
     def __reversed__(self):
         'od.__reversed__() <==> reversed(od)'
-        # Traverse the linked list in reverse order.
-        root = self.__root
-        curr = root.prev
-        while curr is not root:
-            yield curr.key
-            curr = curr.prev
+        head, tail = self.__head, self.__tail
+        hskip, tskip = self.__skip
+        for key in _islice(reversed(tail), len(tail) - tskip):
+            if key is not _DELETED:
+                yield key
+        for pos in range(hskip, len(head)):
+            key = head[pos]
+            if key is not _DELETED:
+                yield key
 
     def clear(self):
         'od.clear() -> None.  Remove all items from od.'
-        root = self.__root
-        root.prev = root.next = root
-        self.__map.clear()
+        del self.__head[:], self.__tail[:]
+        self.__pos.clear()
+        self.__skip[:] = [0, 0]
         dict.clear(self)
 
     def popitem(self, last=True):
@@ -127,20 +173,15 @@ class OrderedDict(dict):
         '''
         if not self:
             raise KeyError('dictionary is empty')
-        root = self.__root
+        # The last key of a non-empty list, and the first key after the skipped
+        # slots, are never tombstones
+        head, tail = self.__head, self.__tail
         if last:
-            link = root.prev
-            link_prev = link.prev
-            link_prev.next = root
-            root.prev = link_prev
+            key = tail[-1] if tail else head[self.__skip[0]]
         else:
-            link = root.next
-            link_next = link.next
-            root.next = link_next
-            link_next.prev = root
-        key = link.key
-        del self.__map[key]
+            key = head[-1] if head else tail[self.__skip[1]]
         value = dict.pop(self, key)
+        self.__discard(key)
         return key, value
 
     def move_to_end(self, key, last=True):
@@ -150,33 +191,85 @@ class OrderedDict(dict):
         When last=True, acts like a fast version of self[key]=self.pop(key).
 
         '''
-        link = self.__map[key]
-        link_prev = link.prev
-        link_next = link.next
-        link_prev.next = link_next
-        link_next.prev = link_prev
-        root = self.__root
+        # Caches often move the most recent key again. It's already in place
+        if last and self.__pos[key] == len(self.__tail) - 1:
+            return
+        self.__discard(key)
         if last:
-            last = root.prev
-            link.prev = last
-            link.next = root
-            last.next = root.prev = link
+            keys = self.__tail
+            self.__pos[key] = len(keys)
         else:
-            first = root.next
-            link.prev = root
-            link.next = first
-            root.next = first.prev = link
+            keys = self.__head
+            self.__pos[key] = ~len(keys)
+        keys.append(key)
 
     def __sizeof__(self):
         sizeof = _sys.getsizeof
-        n = len(self) + 1                       # number of links including root
         size = sizeof(self.__dict__)            # instance dictionary
-        size += sizeof(self.__map) * 2          # internal dict and inherited dict
-        size += sizeof(self.__hardroot) * n     # link objects
-        size += sizeof(self.__root) * n         # proxy objects
+        size += sizeof(self.__pos) * 2          # internal dict and inherited dict
+        size += sizeof(self.__head) + sizeof(self.__tail)   # order lists
+        size += sizeof(len(self)) * len(self)   # positions in internal dict
         return size
 
-    update = __update = MutableMapping.update
+    def update(*args, **kwds):
+        '''D.update([E, ]**F) -> None.  Update D from mapping/iterable E and F.
+        If E present and has a .keys() method, does:     for k in E: D[k] = E[k]
+        If E present and lacks .keys() method, does:     for (k, v) in E: D[k] = v
+        In either case, this is followed by: for k, v in F.items(): D[k] = v
+        '''
+        if not args:
+            raise TypeError("descriptor 'update' of 'OrderedDict' object "
+                            "needs an argument")
+        self, args = args[0], args[1:]
+        if len(args) > 1:
+            raise TypeError('expected at most 1 arguments, got %d' % len(args))
+        # Fast path: bulk-load an empty dict in C, then copy the inherited dict's
+        # key order (Python 3.7+ dicts keep insertion order). Subclasses that
+        # override __setitem__ take the slow path, so that it is called per key.
+        if (not self and _ORDERED_DICT and
+                type(self).__setitem__ is OrderedDict.__setitem__):
+            try:
+                if args:
+                    other = args[0]
+                    if hasattr(other, 'keys'):
+                        dict.update(self, ((key, other[key]) for key in other.keys()))
+                    else:
+                        dict.update(self, other)
+                if kwds:
+                    dict.update(self, kwds)
+            finally:
+                # Index the keys added, even if other raised an error midway
+                tail = self.__tail
+                tail[:] = dict.keys(self)
+                self.__pos.update(zip(tail, range(len(tail))))
+                self.__skip[:] = [0, 0]
+        else:
+            MutableMapping.update(self, *args, **kwds)
+
+    __update = update
+
+    @classmethod
+    def _from_rows(cls, keys, rows):
+        '''Yield an instance for each row of values, mapping keys (a tuple of
+        unique keys) to the row's values. All instances copy one key layout.
+        cls must not override __init__ or __setitem__.'''
+        size = len(keys)
+        layout = dict(zip(keys, range(size)))
+        new, dict_update = cls.__new__, dict.update
+        for row in rows:
+            self = new(cls)
+            dict_update(self, zip(keys, row))
+            state = self.__dict__
+            state['_OrderedDict__head'] = []
+            state['_OrderedDict__skip'] = [0, 0]
+            if len(self) == size:
+                state['_OrderedDict__tail'] = list(keys)
+                state['_OrderedDict__pos'] = layout.copy()
+            else:
+                # Short rows have fewer keys, like zip()
+                tail = state['_OrderedDict__tail'] = list(dict.keys(self))
+                state['_OrderedDict__pos'] = dict(zip(tail, range(len(tail))))
+            yield self
 
     def keys(self):
         "D.keys() -> a set-like object providing a view on D's keys"
@@ -0,0 +1,244 @@
+'''
+Share read-only AttrDicts across processes via shared memory or mmap'd files.
+
+dumps() serializes nested mappings into a compact binary blob. loads() wraps
+any buffer (bytes, mmap, shared memory) in a SharedAttrDict, which decodes keys
+and values only when they're accessed. So N processes share one copy.
+
+Values that aren't mappings, strings, numbers, booleans or None are pickled.
+So only load blobs from trusted sources: unpickling can run arbitrary code.
+
+Blob format (little-endian): a header of b'OAD1' and the root offset (Q),
+followed by records. Each record is a tag (1 byte), a size (Q) and a payload:
+
+- ``M``: a mapping of size items. The payload is size (key, value) pairs of
+  record offsets (QQ), in order
+- ``S``: a UTF-8 string of size bytes. Repeated strings are stored once
+- ``I``, ``D``: a 64-bit int or float, stored in place of the size
+- ``N``, ``T``, ``F``: None, True, False
+- ``P``: any other value, pickled into size bytes
+'''
+
+import os
+import mmap
+import pickle
+import struct
+from collections import OrderedDict
+from . import AttrDict, _PRIVATE
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+_HEADER = struct.Struct('<4sQ')
+_RECORD = struct.Struct('<cQ')
+_INT = struct.Struct('<cq')
+_FLOAT = struct.Struct('<cd')
+_CONSTANTS = {b'N': None, b'T': True, b'F': False}
+# Text is stored as UTF-8. Python 2 byte strings are pickled, so they load as-is
+_TEXT = type(u'')
+_MAGIC = b'OAD1'
+# Processes whose resource tracker was started by attach(), and the names of
+# blocks that share() created in this process
+_OWN_TRACKER = set()
+_CREATED = set()
+
+
+def _encode(value, out, strings):
+    '''Append value to the bytearray out, and return its offset. strings maps
+    strings to the offsets they're already stored at.'''
+    if isinstance(value, Mapping):
+        offsets = []
+        for key, val in value.items():
+            offsets.append(_encode(key, out, strings))
+            offsets.append(_encode(val, out, strings))
+        offset = len(out)
+        out += _RECORD.pack(b'M', len(offsets) // 2)
+        out += struct.pack('<%dQ' % len(offsets), *offsets)
+        return offset
+    offset = len(out)
+    if value is None or value is True or value is False:
+        out += _RECORD.pack(b'N' if value is None else b'T' if value else b'F', 0)
+        return offset
+    if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        out += _INT.pack(b'I', value)
+        return offset
+    if type(value) is float:
+        out += _FLOAT.pack(b'D', value)
+        return offset
+    if isinstance(value, _TEXT):
+        if value in strings:
+            return strings[value]
+        tag, data = b'S', value.encode('utf-8')
+        strings[value] = offset
+    else:
+        tag, data = b'P', pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    out += _RECORD.pack(tag, len(data))
+    out += data
+    return offset
+
+
+def _decode(buf, offset, owner=None):
+    '''Decode the record at offset in the memoryview buf. Mappings keep owner
+    (the buffer's mmap or SharedMemory) alive'''
+    tag, size = _RECORD.unpack_from(buf, offset)
+    if tag == b'M':
+        return SharedAttrDict(buf, offset, owner)
+    if tag in _CONSTANTS:
+        return _CONSTANTS[tag]
+    if tag == b'I':
+        return _INT.unpack_from(buf, offset)[1]
+    if tag == b'D':
+        return _FLOAT.unpack_from(buf, offset)[1]
+    start = offset + _RECORD.size
+    if tag == b'S':
+        return buf[start:start + size].tobytes().decode('utf-8')
+    return pickle.loads(buf[start:start + size].tobytes())
+
+
+def dumps(data):
+    '''Serialize nested mappings (AttrDict, Tree, dict, etc.) into bytes'''
+    out = bytearray(_HEADER.size)
+    root = _encode(data, out, {})
+    _HEADER.pack_into(out, 0, _MAGIC, root)
+    return bytes(out)
+
+
+def loads(buffer):
+    '''Return a read-only SharedAttrDict over a buffer created by dumps()'''
+    return SharedAttrDict(buffer)
+
+
+def dump(data, path):
+    '''Serialize nested mappings into a file, to be opened with load()'''
+    with open(path, 'wb') as handle:
+        handle.write(dumps(data))
+
+
+def load(path):
+    '''Return a read-only SharedAttrDict over a memory-mapped file. Processes
+    that load the same file share its pages. This needs Python 3, since Python
+    2's mmap can't be wrapped in a memoryview.
+
+    Values of other types are pickled, so only load trusted files. Unpickling
+    an untrusted file can run arbitrary code.'''
+    with open(path, 'rb') as handle:
+        buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return SharedAttrDict(buffer)
+
+
+def share(data, name=None):
+    '''
+    Serialize nested mappings into a new multiprocessing SharedMemory block
+    (Python 3.8+) and return it. Workers use attach(shm.name) to read it. Call
+    shm.close() and shm.unlink() when done.
+    '''
+    from multiprocessing import shared_memory
+    blob = dumps(data)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=len(blob))
+    shm.buf[:len(blob)] = blob
+    _CREATED.add(shm.name)
+    return shm
+
+
+def attach(name):
+    '''
+    Return a read-only SharedAttrDict over the SharedMemory block created by
+    share(). The block stays open while the SharedAttrDict (or any value
+    from it) is in use.
+
+    Only the process that called share() unlinks the block. By default, Python
+    tracks attached blocks too, and unlinks them when the worker exits. So this
+    attaches with track=False (Python 3.13+), or stops tracking the block.
+    '''
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, POSIX shared memory is always tracked
+        posix = getattr(shared_memory, '_USE_POSIX', False)
+        if posix:
+            from multiprocessing import resource_tracker
+            if resource_tracker._resource_tracker._fd is None:
+                _OWN_TRACKER.add(os.getpid())
+        shm = shared_memory.SharedMemory(name=name)
+        # Untrack the block only if this process' own tracker registered it.
+        # The creator, and children sharing its tracker, must keep tracking it
+        if posix and os.getpid() in _OWN_TRACKER and shm.name not in _CREATED:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+    return SharedAttrDict(shm.buf, owner=shm)
+
+
+class SharedAttrDict(Mapping):
+    '''
+    A read-only, ordered mapping with attribute-style access over a buffer
+    created by dumps(). Keys of a mapping are decoded when it's first used.
+    Values are decoded when they're first accessed.
+    '''
+    __slots__ = ('_buf', '_offset', '_owner', '_index', '_values')
+
+    def __init__(self, buffer, offset=None, owner=None):
+        buf = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        if offset is None:
+            magic, offset = _HEADER.unpack_from(buf, 0)
+            if magic != _MAGIC:
+                raise ValueError('buffer was not created by sharedutils.dumps()')
+        set_slot = object.__setattr__
+        set_slot(self, '_buf', buf)
+        set_slot(self, '_offset', offset)
+        # Keep the buffer's owner (mmap or SharedMemory) alive
+        set_slot(self, '_owner', owner if owner is not None else buffer)
+        set_slot(self, '_index', None)
+        set_slot(self, '_values', {})
+
+    def _keys(self):
+        '''Return an OrderedDict of key: value offset, decoding keys once'''
+        if self._index is None:
+            buf, offset = self._buf, self._offset
+            tag, size = _RECORD.unpack_from(buf, offset)
+            offsets = struct.unpack_from('<%dQ' % (2 * size), buf, offset + _RECORD.size)
+            keys = [_decode(buf, key) for key in offsets[::2]]
+            object.__setattr__(self, '_index', OrderedDict(zip(keys, offsets[1::2])))
+        return self._index
+
+    def __getitem__(self, key):
+        values = self._values
+        if key not in values:
+            values[key] = _decode(self._buf, self._keys()[key], self._owner)
+        return values[key]
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return _RECORD.unpack_from(self._buf, self._offset)[1]
+
+    def __contains__(self, key):
+        return key in self._keys()
+
+    def __getattr__(self, name):
+        '''Getting sd.x gets sd["x"]'''
+        if name[:1] == '_' and name.startswith(_PRIVATE):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise TypeError('%s is read-only' % self.__class__.__name__)
+
+    __delattr__ = __setattr__
+
+    def to_attrdict(self, cls=AttrDict):
+        '''Decode everything into a nested AttrDict (or cls)'''
+        return cls((key, val.to_attrdict(cls) if isinstance(val, SharedAttrDict) else val)
+                   for key, val in self.items())
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def __str__(self):
+        '''Print like a dict that is human readable'''
+        return '{' + ', '.join('%r: %r' % (key, val) for key, val in self.items()) + '}'
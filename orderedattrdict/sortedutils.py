@@ -0,0 +1,142 @@
+'''
+Sorted AttrDicts, whose keys are kept in sorted order instead of insertion order.
+
+Keys are kept in a sortedcontainers.SortedList, so adding or deleting a key is
+O(log n), and reading keys in order or in a range doesn't sort them again. This
+requires sortedcontainers.
+'''
+
+import sys
+from collections import defaultdict
+from sortedcontainers import SortedList
+from . import AttrDict, CounterAttrDict, Tree
+
+
+class _Sorted(object):
+    '''
+    Mixin for sorted AttrDicts. Keys are in a SortedList in __keys__, and the
+    order methods of the base class use it.
+    '''
+    def __init__(self, *args, **kwargs):
+        self.__dict__['__keys__'] = SortedList()
+        super(_Sorted, self).__init__()
+        self.update(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        # Bulk-load an empty dict in C, and sort its keys at once
+        if self or sys.version_info < (3, 7):
+            return super(_Sorted, self).update(*args, **kwargs)
+        try:
+            dict.update(self, *args, **kwargs)
+        finally:
+            # Index the keys added, even if the input raised an error midway.
+            # If the keys can't be sorted, don't add any of them
+            try:
+                self.__keys__.update(dict.keys(self))
+            except TypeError:
+                dict.clear(self)
+                raise
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.__keys__.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.__keys__.remove(key)
+
+    def __iter__(self):
+        return iter(self.__keys__)
+
+    def __reversed__(self):
+        return reversed(self.__keys__)
+
+    def clear(self):
+        dict.clear(self)
+        self.__keys__.clear()
+
+    def popitem(self, last=True):
+        '''Remove and return the (key, value) item with the largest key, or the
+        smallest if last is false'''
+        if not self:
+            raise KeyError('dictionary is empty')
+        key = self.__keys__.pop(-1 if last else 0)
+        return key, dict.pop(self, key)
+
+    def move_to_end(self, key, last=True):
+        raise NotImplementedError('%s keys are always sorted' % self.__class__.__name__)
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False):
+        '''
+        Iterate over keys from minimum to maximum. None means no limit. inclusive
+        is a pair of booleans: whether to include the minimum and maximum.
+        '''
+        return self.__keys__.irange(minimum, maximum, inclusive, reverse)
+
+    def bisect_left(self, key):
+        '''Return the position where key would be inserted, before equal keys'''
+        return self.__keys__.bisect_left(key)
+
+    def bisect_right(self, key):
+        '''Return the position where key would be inserted, after equal keys'''
+        return self.__keys__.bisect_right(key)
+
+    bisect = bisect_right
+
+    def index(self, key):
+        '''Return the position of key. Raises ValueError if key is missing'''
+        return self.__keys__.index(key)
+
+    def peekitem(self, index=-1):
+        '''Return the (key, value) item at position index. Default: the last'''
+        key = self.__keys__[index]
+        return key, dict.__getitem__(self, key)
+
+    def __reduce_ex__(self, protocol):
+        func, args, state = super(_Sorted, self).__reduce_ex__(protocol)
+        state[2].pop('__keys__', None)
+        return func, args, state
+
+    def __setstate__(self, state):
+        self.__dict__['__keys__'] = SortedList()
+        super(_Sorted, self).__setstate__(state)
+
+    def snapshot(self):
+        snap = super(_Sorted, self).snapshot()
+        snap.__dict__['__keys__'] = SortedList(self.__keys__)
+        return snap
+
+
+class SortedAttrDict(_Sorted, AttrDict):
+    '''
+    An AttrDict whose keys are always in sorted order. Keys must be comparable
+    with each other. Adding and deleting keys is O(log n).
+
+    >>> ad = SortedAttrDict(b=2, c=3, a=1)
+    >>> list(ad)
+    ['a', 'b', 'c']
+    >>> list(ad.irange('b', 'z'))
+    ['b', 'c']
+    >>> ad.peekitem(0)
+    ('a', 1)
+
+    move_to_end() raises NotImplementedError.
+    '''
+
+
+class SortedCounterAttrDict(_Sorted, CounterAttrDict):
+    '''
+    A CounterAttrDict whose keys are always in sorted order, e.g. counts per
+    time bucket.
+    '''
+
+
+class SortedTree(_Sorted, Tree):
+    '''
+    A Tree whose keys are always in sorted order, at every level. Nodes created
+    via attribute access or paths are SortedTrees too.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(SortedTree, self).__init__(*args, **kwargs)
+        defaultdict.__init__(self, SortedTree)
@@ -1,10 +1,18 @@
 'YAML utilities for working with AttrDicts'
 
-from . import AttrDict
-from yaml import Loader, MappingNode
+from . import AttrDict, DictAttrDict, FrozenAttrDict, LazyAttrDict, _Lazy
+from yaml import Loader, SafeLoader, MappingNode, CollectionNode
+from yaml import MappingStartEvent, MappingEndEvent, StreamEndEvent
+from yaml.composer import Composer
 from yaml.constructor import ConstructorError
 from yaml.representer import Representer, SafeRepresenter
 
+# libyaml's C parser is much faster, but may not be installed
+try:
+    from yaml import CSafeLoader
+except ImportError:
+    CSafeLoader = SafeLoader
+
 
 def from_yaml(loader, node):
     'Load mapping as AttrDict, preserving order'
@@ -15,6 +23,8 @@ def from_yaml(loader, node):
         raise ConstructorError(
             None, None, 'expected a mapping node, but found %s' % node.id, node.start_mark)
     loader.flatten_mapping(node)
+    # yamlutils.load(..., intern=) sets an Interner that shares repeated keys
+    interner = getattr(loader, 'interner', None)
     for key_node, value_node in node.value:
         key = loader.construct_object(key_node, deep=False)
         try:
@@ -23,7 +33,36 @@ def from_yaml(loader, node):
             raise ConstructorError(
                 'while constructing a mapping', node.start_mark,
                 'found unacceptable key (%s)' % exc, key_node.start_mark)
-        attrdict[key] = loader.construct_object(value_node, deep=False)
+        value = loader.construct_object(value_node, deep=False)
+        if interner is not None:
+            key, value = interner.key(key), interner.value(value)
+        attrdict[key] = value
+
+
+def from_yaml_lazy(loader, node):
+    '''
+    Load mapping as LazyAttrDict, preserving order. Keys and scalar values are
+    loaded right away. Nested mappings and sequences are loaded on first access.
+    '''
+    if not isinstance(node, MappingNode):
+        raise ConstructorError(
+            None, None, 'expected a mapping node, but found %s' % node.id, node.start_mark)
+    loader.flatten_mapping(node)
+    pairs = []
+    for key_node, value_node in node.value:
+        key = loader.construct_object(key_node, deep=True)
+        try:
+            hash(key)
+        except TypeError as exc:
+            raise ConstructorError(
+                'while constructing a mapping', node.start_mark,
+                'found unacceptable key (%s)' % exc, key_node.start_mark)
+        if isinstance(value_node, CollectionNode):
+            # deep=True constructs the whole value, not just its outer object
+            pairs.append((key, _Lazy(loader.construct_object, value_node, True)))
+        else:
+            pairs.append((key, loader.construct_object(value_node, deep=True)))
+    return LazyAttrDict(pairs)
 
 
 class AttrDictYAMLLoader(Loader):
@@ -32,10 +71,148 @@ class AttrDictYAMLLoader(Loader):
     >>> attrdict = yaml.load('x: 1\ny: 2', Loader=AttrDictYAMLLoader)
     '''
 
-    def __init__(self, *args, **kwargs):
-        super(AttrDictYAMLLoader, self).__init__(*args, **kwargs)
-        self.add_constructor(u'tag:yaml.org,2002:map', from_yaml)
-        self.add_constructor(u'tag:yaml.org,2002:omap', from_yaml)
+
+class AttrDictSafeLoader(SafeLoader):
+    '''A safe YAML loader that loads mappings into ordered AttrDict. Like
+    yaml.safe_load, it only constructs standard YAML tags.
+
+    >>> attrdict = yaml.load('x: 1\ny: 2', Loader=AttrDictSafeLoader)
+    '''
+
+
+class AttrDictCSafeLoader(CSafeLoader):
+    '''A safe YAML loader that loads mappings into ordered AttrDict using the
+    libyaml C parser. If libyaml is not installed, it's the same as
+    AttrDictSafeLoader.
+
+    >>> attrdict = yaml.load('x: 1\ny: 2', Loader=AttrDictCSafeLoader)
+    '''
+
+
+class LazyAttrDictYAMLLoader(Loader):
+    '''A YAML loader that loads mappings into ordered LazyAttrDict. Nested
+    mappings and sequences are constructed only when they're accessed. The
+    document is still fully parsed, and its unused nodes are kept in memory.
+
+    >>> attrdict = yaml.load(open('big.yaml'), Loader=LazyAttrDictYAMLLoader)
+    '''
+
+
+class LazyAttrDictCSafeLoader(CSafeLoader):
+    '''A safe YAML loader like LazyAttrDictYAMLLoader that uses the libyaml C
+    parser, if it's installed.
+
+    >>> attrdict = yaml.load(open('big.yaml'), Loader=LazyAttrDictCSafeLoader)
+    '''
+
+
+# Register constructors once, rather than each time a loader is created
+for _loader in (AttrDictYAMLLoader, AttrDictSafeLoader, AttrDictCSafeLoader):
+    _loader.add_constructor(u'tag:yaml.org,2002:map', from_yaml)
+    _loader.add_constructor(u'tag:yaml.org,2002:omap', from_yaml)
+for _loader in (LazyAttrDictYAMLLoader, LazyAttrDictCSafeLoader):
+    _loader.add_constructor(u'tag:yaml.org,2002:map', from_yaml_lazy)
+    _loader.add_constructor(u'tag:yaml.org,2002:omap', from_yaml_lazy)
+
+
+def load(stream, Loader=AttrDictSafeLoader, intern=None):
+    '''
+    Load a single YAML document, like yaml.safe_load. Pass
+    Loader=AttrDictYAMLLoader to construct Python objects from trusted YAML.
+    intern= is an optional Interner that shares repeated keys (and values)
+    across mappings.
+
+    >>> table = Interner()
+    >>> data = load(open('inventory.yaml'), intern=table)
+    '''
+    loader = Loader(stream)
+    loader.interner = intern
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+def _add_composer(loader):
+    '''
+    libyaml's CParser composes whole documents in C, and has no compose_node().
+    Add the pure Python Composer's methods to loader. They build nodes from
+    CParser's events.
+    '''
+    if not hasattr(loader, 'compose_node'):
+        for name in ('compose_node', 'compose_scalar_node', 'compose_sequence_node',
+                     'compose_mapping_node'):
+            setattr(loader, name, Composer.__dict__[name].__get__(loader))
+        loader.anchors = {}
+
+
+def iter_load(stream, Loader=AttrDictSafeLoader, by='document', intern=None):
+    '''
+    Lazily load a YAML stream, holding only one item in memory at a time.
+
+    - ``by='document'`` yields each document in a multi-document stream
+    - ``by='key'`` yields each ``(key, value)`` of each document's top-level
+      mapping. Use this for huge single-document mappings. Aliases across
+      top-level keys load as copies, not as the same object. C loaders like
+      AttrDictCSafeLoader parse faster, but build nodes in Python here.
+
+    intern= is an optional Interner that shares repeated keys across documents.
+    The default Loader only constructs standard YAML tags, like yaml.safe_load.
+
+    >>> for doc in iter_load(open('log.yaml')):
+    ...     print(doc.timestamp)
+    '''
+    loader = Loader(stream)
+    loader.interner = intern
+    try:
+        if by == 'document':
+            while loader.check_data():
+                yield loader.get_data()
+        elif by == 'key':
+            _add_composer(loader)
+            loader.get_event()                  # StreamStartEvent
+            while not loader.check_event(StreamEndEvent):
+                loader.get_event()              # DocumentStartEvent
+                if not loader.check_event(MappingStartEvent):
+                    event = loader.peek_event()
+                    raise ConstructorError(None, None, 'expected a mapping, but found %s' %
+                                           event.__class__.__name__, event.start_mark)
+                loader.get_event()              # MappingStartEvent
+                while not loader.check_event(MappingEndEvent):
+                    key_node = loader.compose_node(None, None)
+                    value_node = loader.compose_node(None, None)
+                    # Construct a single-item mapping via from_yaml. This handles
+                    # key checks and << merge keys just like a full load
+                    node = MappingNode(u'tag:yaml.org,2002:map', [(key_node, value_node)])
+                    for item in loader.construct_document(node).items():
+                        yield item
+                loader.get_event()              # MappingEndEvent
+                loader.get_event()              # DocumentEndEvent
+                loader.anchors = {}
+        else:
+            raise ValueError('by= must be "document" or "key", not %r' % by)
+    finally:
+        loader.dispose()
+
+
+def load_many(strings, Loader=AttrDictSafeLoader, intern=None):
+    '''
+    Lazily load each YAML document in an iterable of strings (or streams).
+    The default Loader only constructs standard YAML tags, like yaml.safe_load.
+    For high volumes of small documents, Loader=AttrDictCSafeLoader is several
+    times faster than the default. intern= is an optional Interner that shares
+    repeated keys across documents.
+
+    >>> for msg in load_many(messages, Loader=AttrDictCSafeLoader):
+    ...     print(msg.id)
+    '''
+    for string in strings:
+        loader = Loader(string)
+        loader.interner = intern
+        try:
+            yield loader.get_single_data()
+        finally:
+            loader.dispose()
 
 
 def to_yaml(dumper, data):
@@ -45,8 +222,10 @@ def to_yaml(dumper, data):
     return dumper.represent_mapping(u'tag:yaml.org,2002:map', data.items())
 
 
-SafeRepresenter.add_representer(AttrDict, to_yaml)
-SafeRepresenter.add_multi_representer(AttrDict, to_yaml)
+# SafeDumper and CSafeDumper use SafeRepresenter. Dumper and CDumper use Representer
+for _cls in (AttrDict, DictAttrDict, FrozenAttrDict):
+    SafeRepresenter.add_representer(_cls, to_yaml)
+    SafeRepresenter.add_multi_representer(_cls, to_yaml)
 
-Representer.add_representer(AttrDict, to_yaml)
-Representer.add_multi_representer(AttrDict, to_yaml)
+    Representer.add_representer(_cls, to_yaml)
+    Representer.add_multi_representer(_cls, to_yaml)
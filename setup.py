@@ -33,4 +33,5 @@ setup(
         'Topic :: Software Development :: Libraries :: Python Modules'],
     test_suite='tests',
     tests_require=['PyYAML'],
+    extras_require={'numpy': ['numpy'], 'sorted': ['sortedcontainers']},
 )
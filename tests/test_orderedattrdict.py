@@ -1,11 +1,44 @@
+import io
 import os
+import sys
+import copy
+import gc
+import math
 import json
+import pickle
 import yaml
 import random
+import timeit
+import itertools
+import threading
+import tempfile
 import unittest
 from collections import OrderedDict
 from orderedattrdict import AttrDict, DefaultAttrDict, CounterAttrDict, Tree
-from orderedattrdict.yamlutils import AttrDictYAMLLoader, from_yaml
+from orderedattrdict import DictAttrDict, FrozenAttrDict, LazyAttrDict, freeze, thaw
+from orderedattrdict import RecordSchema, AttrRecord, flatten, unflatten, ChainAttrDict
+from orderedattrdict import deep_merge, diff, patch, Interner
+from orderedattrdict import ConcurrentCounterAttrDict, ConcurrentDefaultAttrDict
+from orderedattrdict import LRUAttrDict, TTLAttrDict, IndexedAttrDict
+from orderedattrdict.ordereddict import OrderedDict as PyOrderedDict
+from orderedattrdict import jsonutils, sharedutils
+from orderedattrdict.yamlutils import AttrDictYAMLLoader, from_yaml, iter_load
+from orderedattrdict.yamlutils import AttrDictSafeLoader, AttrDictCSafeLoader, load_many
+from orderedattrdict.yamlutils import LazyAttrDictYAMLLoader, LazyAttrDictCSafeLoader
+from orderedattrdict import yamlutils
+
+# NumPy is optional
+try:
+    import numpy as np
+    from orderedattrdict.numpyutils import ArrayCounterAttrDict
+except ImportError:
+    np = None
+
+# sortedcontainers is optional
+try:
+    from orderedattrdict.sortedutils import SortedAttrDict, SortedCounterAttrDict, SortedTree
+except ImportError:
+    SortedAttrDict = None
 
 
 # In Python 3, chr is unichr
@@ -14,6 +47,9 @@ try:
 except NameError:
     unichr = chr
 
+# Python 2's json and yaml dump byte strings, which io.StringIO rejects
+TextIO = io.StringIO if sys.version_info[0] >= 3 else io.BytesIO
+
 
 class Generator(object):
     '''
@@ -169,6 +205,42 @@ class TestAttrDict(unittest.TestCase):
         #   ad.viewvalues()
         #   ad.viewitems()
 
+    def test_from_rows(self):
+        'Bulk-create AttrDicts from pairs and rows'
+        keys = ['x', '_y', 3]
+        ad = self.klass.from_pairs(zip(keys, [1, 2, 3]))
+        self.assertEqual(ad, OrderedDict([('x', 1), ('_y', 2), (3, 3)]))
+        self.assertIsInstance(ad, self.klass)
+
+        rows = [(1, 2, 3), (4, 5, 6), (7, 8)]
+        result = list(self.klass.from_rows(keys, iter(rows)))
+        self.assertEqual(result, [OrderedDict(zip(keys, row)) for row in rows])
+        self.assertTrue(all(isinstance(ad, self.klass) for ad in result))
+        self.assertEqual(result[0].x, 1)
+        # Each row's key order is independent of the others
+        result[0].move_to_end('x')
+        del result[1]['_y']
+        result[2].z = 9
+        self.assertEqual(list(result[0]), ['_y', 3, 'x'])
+        self.assertEqual(list(result[1]), ['x', 3])
+        self.assertEqual(list(result[2]), ['x', '_y', 'z'])
+        with self.assertRaises(ValueError):
+            self.klass.from_rows(['x', 'x'], rows)
+
+    def test_pickle(self):
+        'Pickle and copy nested and recursive AttrDicts'
+        ad = self.klass([('x', 1), ('_y', self.klass(z=[1])), (3, 3)])
+        ad['self'] = ad
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            result = pickle.loads(pickle.dumps(ad, protocol=protocol))
+            self.assertIs(type(result), self.klass)
+            self.assertIs(type(result['_y']), self.klass)
+            self.assertIs(result['self'], result)
+            self.assertEqual(list(result.items())[:3], list(ad.items())[:3])
+        result = copy.deepcopy(ad)
+        self.assertEqual(list(result), list(ad))
+        self.assertIsNot(result['_y'].z, ad['_y'].z)
+
     def test_str(self):
         items = [('x', 1), ('_y', 2), (3, 3)]
         ad = self.klass(items)
@@ -212,6 +284,30 @@ class TestAttrDict(unittest.TestCase):
             self.assertEqual(ad, yaml.safe_load(yaml.dump(ad)))
             self.assertEqual(ad, yaml.safe_load(yaml.safe_dump(ad)))
 
+    def test_safe_yaml(self):
+        'Load YAML with safe loaders, and dump with safe dumpers'
+        dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        for loader in (AttrDictSafeLoader, AttrDictCSafeLoader):
+            for iteration in range(10):
+                ad = self.gen.obj(10)
+                result = yaml.load(yaml.dump(ad, Dumper=dumper), Loader=loader)
+                self.assertEqual(ad, result)
+                self.assertIsInstance(result, AttrDict)
+            with self.assertRaises(yaml.constructor.ConstructorError):
+                yaml.load('!!python/object/apply:os.getcwd []', Loader=loader)
+        self.assertEqual(yaml.safe_dump(self.klass([('b', 1), ('a', 2)])), 'b: 1\na: 2\n')
+
+    def test_load_many(self):
+        'Load a batch of YAML documents'
+        ads = [self.gen.obj(5) for iteration in range(10)]
+        for loader in (AttrDictYAMLLoader, AttrDictSafeLoader, AttrDictCSafeLoader):
+            self.assertEqual(list(load_many((yaml.dump(ad) for ad in ads), Loader=loader)), ads)
+        # Python tags are only loaded with an unsafe Loader
+        unsafe = ['a: !!python/object/apply:os.getcwd []']
+        with self.assertRaises(yaml.constructor.ConstructorError):
+            list(load_many(unsafe))
+        self.assertEqual(list(load_many(unsafe, Loader=AttrDictYAMLLoader)), [{'a': os.getcwd()}])
+
     def test_mergetag(self):
         'Check if YAML merge tag works'
         folder = os.path.dirname(os.path.abspath(__file__))
@@ -220,11 +316,62 @@ class TestAttrDict(unittest.TestCase):
                 {'base': {'key': 'value'}, 'derived': {'key': 'value'}},
                 yaml.load(handle, Loader=AttrDictYAMLLoader))
 
+    def test_iter_load(self):
+        'Load YAML documents and top-level keys lazily'
+        text = 'a: &x {p: 1}\nb: [1, 2]\n<<: {m: 3}\nc: *x\n---\nd: 4\n--- [invalid\n'
+        docs = iter_load(text)
+        self.assertEqual(next(docs), yaml.load(text.split('---')[0], Loader=AttrDictYAMLLoader))
+        self.assertEqual(next(docs), {'d': 4})
+        with self.assertRaises(yaml.YAMLError):
+            next(docs)
+
+        for loader in (AttrDictSafeLoader, AttrDictCSafeLoader):
+            items = iter_load(text, Loader=loader, by='key')
+            self.assertEqual(next(items), ('a', {'p': 1}))
+            self.assertEqual(next(items), ('b', [1, 2]))
+            self.assertEqual(next(items), ('m', 3))
+            key, val = next(items)
+            self.assertEqual((key, val), ('c', {'p': 1}))
+            self.assertIsInstance(val, AttrDict)
+            self.assertEqual(next(items), ('d', 4))
+            with self.assertRaises(yaml.YAMLError):
+                next(items)
+
+        with self.assertRaises(yaml.YAMLError):
+            list(iter_load('- 1', by='key'))
+        with self.assertRaises(ValueError):
+            list(iter_load('a: 1', by='row'))
+
+        # Python tags are only loaded with an unsafe Loader
+        unsafe = 'a: !!python/object/apply:os.getcwd []\n'
+        for by in ('document', 'key'):
+            with self.assertRaises(yaml.constructor.ConstructorError):
+                list(iter_load(unsafe, by=by))
+        self.assertEqual(list(iter_load(unsafe, Loader=AttrDictYAMLLoader)), [{'a': os.getcwd()}])
+
     def test_json(self):
         for iteration in range(10):
             ad = self.gen.obj(10)
             self.assertEqual(ad, json.loads(json.dumps(ad), object_pairs_hook=self.klass))
 
+    def test_jsonutils(self):
+        'Load and dump JSON and JSON Lines via jsonutils'
+        ads = [self.gen.obj(10) for iteration in range(10)]
+        for ad in ads:
+            result = jsonutils.loads(jsonutils.dumps(ad), cls=self.klass)
+            self.assertEqual(ad, result)
+            self.assertIsInstance(result, self.klass)
+            handle = TextIO()
+            jsonutils.dump(ad, handle)
+            handle.seek(0)
+            self.assertEqual(ad, jsonutils.load(handle, cls=self.klass))
+
+        text = '\n'.join(jsonutils.dumps(ad) for ad in ads) + '\n\n'
+        self.assertEqual(list(jsonutils.iter_load(TextIO(text), cls=self.klass)), ads)
+        rows = jsonutils.iter_load(io.BytesIO(text.encode('utf-8')))
+        self.assertIsInstance(next(rows), AttrDict)
+        self.assertEqual(len(list(rows)), len(ads) - 1)
+
     def test_files(self):
         'Ensure that test JSON files have values in sorted order'
         folder = os.path.dirname(os.path.abspath(__file__))
@@ -261,6 +408,15 @@ class TestDefaultAttrDict(TestAttrDict):
         ad.z = ad.z + 3
         self.assertEqual(ad, {'x': 1, 'y': 2, 'z': 3})
 
+    def test_defaultdict_pickle(self):
+        'DefaultAttrDict keeps its default_factory when pickled or copied'
+        ad = DefaultAttrDict(list, [('x', [1])])
+        for result in (pickle.loads(pickle.dumps(ad)), copy.copy(ad), copy.deepcopy(ad)):
+            self.assertEqual(result, ad)
+            self.assertEqual(result.default_factory, list)
+            self.assertEqual(result.y, [])
+        self.assertNotIn(b'exclude', pickle.dumps(ad))
+
     def test_defaultdict_with_list(self):
         'DefaultAttrDict as a list generator'
         ad = DefaultAttrDict(list)
@@ -306,6 +462,237 @@ class TestDefaultAttrDict(TestAttrDict):
         self.assertEqual(ad, {'a': {'b': {'c': 1}}})
 
 
+class TestPyOrderedDict(unittest.TestCase):
+    def test_random_operations(self):
+        'Pure Python OrderedDict behaves like collections.OrderedDict'
+        random.seed(0)
+        pod, od = PyOrderedDict(), OrderedDict()
+        for iteration in range(20000):
+            op = random.randint(0, 5)
+            key = random.randint(0, 100)
+            if op <= 1:
+                pod[key] = od[key] = iteration
+            elif op == 2 and key in od:
+                del pod[key], od[key]
+            elif op == 3 and key in od:
+                last = random.random() < 0.5
+                pod.move_to_end(key, last=last)
+                od.move_to_end(key, last=last)
+            elif op == 4 and od:
+                last = random.random() < 0.5
+                self.assertEqual(pod.popitem(last=last), od.popitem(last=last))
+            elif op == 5:
+                self.assertEqual(list(pod.items()), list(od.items()))
+                self.assertEqual(list(reversed(pod)), list(reversed(od)))
+        self.assertEqual(list(pod.items()), list(od.items()))
+        with self.assertRaises(KeyError):
+            pod.move_to_end('missing')
+        pod.clear()
+        with self.assertRaises(KeyError):
+            pod.popitem()
+        self.assertEqual(pickle.loads(pickle.dumps(pod)), pod)
+
+    def test_delete_from_ends(self):
+        'Deleting the first or last key, as FIFO and LIFO queues do, keeps order'
+        for first in (True, False):
+            pod, od = PyOrderedDict(), OrderedDict()
+            for key in range(50):
+                pod[key] = od[key] = key
+            pod.move_to_end(10, last=False)
+            od.move_to_end(10, last=False)
+            for key in range(50, 200):
+                end = iter if first else reversed
+                oldest = next(end(od))
+                self.assertEqual(next(end(pod)), oldest)
+                del pod[oldest], od[oldest]
+                pod[key] = od[key] = key
+                self.assertEqual(list(pod), list(od))
+                self.assertEqual(list(reversed(pod)), list(reversed(od)))
+            self.assertEqual(pod.popitem(last=False), od.popitem(last=False))
+            self.assertEqual(pod.popitem(), od.popitem())
+
+    def test_bulk_update(self):
+        'Constructing from pairs or mappings keeps order and calls __setitem__ overrides'
+        pod = PyOrderedDict([('a', 1), ('b', 2), ('a', 3)], c=4)
+        self.assertEqual(list(pod.items()), [('a', 3), ('b', 2), ('c', 4)])
+        pod.move_to_end('a')
+        self.assertEqual(list(PyOrderedDict(pod)), ['b', 'c', 'a'])
+        self.assertEqual(list(AttrDict(pod)), ['b', 'c', 'a'])
+
+        calls = []
+
+        class Logged(PyOrderedDict):
+            def __setitem__(self, key, value):
+                calls.append(key)
+                super(Logged, self).__setitem__(key, value)
+
+        self.assertEqual(list(Logged(pod)), ['b', 'c', 'a'])
+        self.assertEqual(calls, ['b', 'c', 'a'])
+
+    def test_failed_update(self):
+        'If the input raises an error midway, the keys added so far are in order'
+        def pairs():
+            yield 'a', 1
+            yield 'b', 2
+            raise ValueError('input failed')
+
+        for cls in (PyOrderedDict, AttrDict, IndexedAttrDict):
+            ad = cls()
+            with self.assertRaises(ValueError):
+                ad.update(pairs())
+            self.assertEqual(len(ad), 2)
+            self.assertEqual(list(ad), ['a', 'b'])
+            self.assertEqual(ad.popitem(), ('b', 2))
+
+
+class TestDictAttrDict(TestAttrDict):
+    'DictAttrDict inherits all AttrDict behaviour'
+
+    def setUp(self):
+        super(TestDictAttrDict, self).setUp()
+        self.klass = DictAttrDict
+
+    def test_order(self):
+        ad = self.klass([('x', 1), ('y', 2), ('z', 3)])
+        ad.move_to_end('x')
+        self.assertEqual(list(ad), ['y', 'z', 'x'])
+        ad.move_to_end('x', last=False)
+        self.assertEqual(list(ad), ['x', 'y', 'z'])
+        self.assertEqual(list(reversed(ad)), ['z', 'y', 'x'])
+        with self.assertRaises(KeyError):
+            ad.move_to_end('missing')
+        self.assertEqual(ad.popitem(last=False), ('x', 1))
+        self.assertEqual(ad.popitem(), ('z', 3))
+
+        # Equality is order-sensitive against DictAttrDicts only, and symmetric
+        self.assertNotEqual(self.klass(x=1, y=2), self.klass(y=2, x=1))
+        self.assertEqual(self.klass(x=1, y=2), {'y': 2, 'x': 1})
+        for other in (OrderedDict([('y', 2), ('x', 1)]), AttrDict([('y', 2), ('x', 1)])):
+            self.assertEqual(self.klass(x=1, y=2) == other, other == self.klass(x=1, y=2))
+            self.assertEqual(self.klass(x=1, y=2) != other, other != self.klass(x=1, y=2))
+
+    def test_recursive_repr(self):
+        ad = self.klass(x=1)
+        ad.self = ad
+        self.assertEqual(repr(ad), "DictAttrDict([('x', 1), ('self', ...)])")
+
+
+class TestLazyAttrDict(TestAttrDict):
+    'LazyAttrDict inherits all AttrDict behaviour'
+
+    def setUp(self):
+        super(TestLazyAttrDict, self).setUp()
+        self.klass = LazyAttrDict
+        self.data = AttrDict([
+            ('a', AttrDict([('b', [1, AttrDict(c=2)]), ('d', None)])),
+            ('e', 'x'),
+            ('f', AttrDict(g=AttrDict(h=1.5))),
+        ])
+
+    def check(self, ad):
+        self.assertIsInstance(ad, LazyAttrDict)
+        self.assertEqual(list(ad), ['a', 'e', 'f'])
+        # Nested values are loaded on first access, and then cached
+        self.assertNotIsInstance(dict.__getitem__(ad, 'a'), LazyAttrDict)
+        self.assertIsInstance(ad.a, LazyAttrDict)
+        self.assertIs(ad.a, dict.__getitem__(ad, 'a'))
+        self.assertEqual(ad.a.b[1].c, 2)
+        self.assertEqual(ad.get('f'), self.data.f)
+        self.assertEqual(ad.get('missing', 0), 0)
+        self.assertEqual(ad, self.data)
+        self.assertEqual(self.data, ad)
+        self.assertEqual(json.loads(json.dumps(ad)), self.data)
+        self.assertEqual(yaml.load(yaml.dump(ad), Loader=AttrDictYAMLLoader), self.data)
+        self.assertEqual(pickle.loads(pickle.dumps(ad)), self.data)
+
+    def test_json(self):
+        text = json.dumps(self.data)
+        self.check(jsonutils.lazy_loads(text))
+        self.check(jsonutils.lazy_load(TextIO(text)))
+        self.assertEqual(jsonutils.lazy_loads('[1, {"x": [2]}]'), [1, AttrDict(x=[2])])
+        ad = jsonutils.lazy_loads(text)
+        self.assertEqual(ad.pop('f'), self.data.f)
+        self.assertEqual(ad.popitem(), ('e', 'x'))
+        self.assertEqual(ad.popitem(), ('a', self.data.a))
+
+    def test_yaml(self):
+        text = yaml.dump(self.data)
+        for loader in (LazyAttrDictYAMLLoader, LazyAttrDictCSafeLoader):
+            self.check(yaml.load(text, Loader=loader))
+        # Aliases and merge keys work like AttrDictYAMLLoader
+        text = 'a: &x {b: [1], c: 2}\nd: *x\ne: {<<: *x, f: 3}'
+        result = yaml.load(text, Loader=LazyAttrDictYAMLLoader)
+        self.assertEqual(result, yaml.load(text, Loader=AttrDictYAMLLoader))
+        self.assertIs(result.a, result.d)
+
+
+class TestIndexedAttrDict(TestAttrDict):
+    'IndexedAttrDict inherits all AttrDict behaviour'
+
+    def setUp(self):
+        super(TestIndexedAttrDict, self).setUp()
+        self.klass = IndexedAttrDict
+
+    def test_positions(self):
+        ad = self.klass((key, i) for i, key in enumerate('abcdef'))
+        self.assertEqual([ad.at(i) for i in range(6)], list('abcdef'))
+        self.assertEqual(ad.at(-1), 'f')
+        self.assertEqual([ad.index(key) for key in 'abcdef'], list(range(6)))
+        self.assertRaises(IndexError, ad.at, 6)
+        self.assertRaises(KeyError, ad.index, 'x')
+        self.assertEqual(ad.items_slice(1, 3), [('b', 1), ('c', 2)])
+        self.assertEqual(ad.items_slice(-2), [('e', 4), ('f', 5)])
+        self.assertEqual(ad.items_slice(0, 2, reverse=True), [('f', 5), ('e', 4)])
+        self.assertEqual(ad.items_slice(4, 10, reverse=True), [('b', 1), ('a', 0)])
+        self.assertEqual(ad.items_slice(3, 1), [])
+        del ad.b
+        ad.move_to_end('a')
+        ad.move_to_end('f', last=False)
+        ad.g = 6
+        self.assertEqual(list(ad), list('fcdeag'))
+        self.assertEqual(ad.at(1), 'c')
+        self.assertEqual(ad.index('g'), 5)
+        self.assertEqual(ad.popitem(last=False), ('f', 5))
+        self.assertEqual(ad.items_slice(), list(ad.items()))
+        for copied in (ad.copy(), copy.copy(ad), pickle.loads(pickle.dumps(ad)), ad.snapshot()):
+            self.assertEqual(list(copied), list('cdeag'))
+            self.assertEqual(copied.at(3), 'a')
+
+    def test_random_operations(self):
+        'Positions match a list of the keys after random changes'
+        random.seed(0)
+        ad, keys = self.klass(), []
+        for step in range(5000):
+            op = random.random()
+            if op < 0.5 or not keys:
+                key = random.randrange(500)
+                if key not in ad:
+                    keys.append(key)
+                ad[key] = step
+            elif op < 0.7:
+                key = random.choice(keys)
+                keys.remove(key)
+                del ad[key]
+            elif op < 0.9:
+                key = random.choice(keys)
+                keys.remove(key)
+                last = op < 0.8
+                keys.insert(len(keys) if last else 0, key)
+                ad.move_to_end(key, last=last)
+            else:
+                last = op < 0.95
+                self.assertEqual(ad.popitem(last=last)[0], keys.pop(-1 if last else 0))
+            if keys:
+                pos = random.randrange(len(keys))
+                self.assertEqual(ad.at(pos), keys[pos])
+                self.assertEqual(ad.index(keys[pos]), pos)
+        self.assertEqual(list(ad), keys)
+        self.assertEqual(list(reversed(ad)), keys[::-1])
+        self.assertEqual([key for key, val in ad.items_slice(10, 20)], keys[10:20])
+        self.assertEqual([key for key, val in ad.items_slice(10, 20, reverse=True)],
+                         keys[::-1][10:20])
+
+
 class TestCounterAttrDict(unittest.TestCase):
     def test_counterattrdict(self):
         ad = CounterAttrDict()
@@ -326,8 +713,341 @@ class TestCounterAttrDict(unittest.TestCase):
         ad['z'] += 3
         self.assertEqual(ad, {'x': 1, 'y': 2, 'z': 3})
 
+        result = pickle.loads(pickle.dumps(ad))
+        self.assertIs(type(result), CounterAttrDict)
+        self.assertEqual(list(result.items()), [('x', 1), ('y', 2), ('z', 3)])
+        self.assertEqual(result.w, 0)
+
+
+def run_threads(func, threads=8):
+    'Run func() in several threads at once and wait for them to finish'
+    workers = [threading.Thread(target=func) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class TestConcurrentAttrDict(unittest.TestCase):
+    def test_counter(self):
+        ad = ConcurrentCounterAttrDict()
+        self.assertEqual(ad.add('x'), 1)
+        self.assertEqual(ad.add('y', 2), 2)
+        ad.z += 1
+        self.assertEqual(list(ad.items()), [('x', 1), ('y', 2), ('z', 1)])
+        self.assertEqual(ad.w, 0)
+        self.assertEqual(ad.most_common(1), [('y', 2)])
+        for result in (pickle.loads(pickle.dumps(ad)), copy.deepcopy(ad)):
+            self.assertIs(type(result), ConcurrentCounterAttrDict)
+            self.assertEqual(list(result.items()), [('x', 1), ('y', 2), ('z', 1)])
+            self.assertEqual(result.add('x'), 2)
+
+        keys = ['k%d' % i for i in range(20)]
+
+        def work():
+            for i in range(2000):
+                ad.add(keys[i % 20])
+                with ad.locked(keys[i % 7]):
+                    ad[keys[i % 7]] += 1
+
+        ad = ConcurrentCounterAttrDict()
+        run_threads(work)
+        self.assertEqual(sum(ad.values()), 8 * 2 * 2000)
+        self.assertEqual(sorted(ad), sorted(keys))
+
+    def test_default(self):
+        ad = ConcurrentDefaultAttrDict(list)
+        ad.x.append(1)
+        self.assertEqual(ad, {'x': [1]})
+        result = pickle.loads(pickle.dumps(ad))
+        self.assertIs(type(result), ConcurrentDefaultAttrDict)
+        self.assertEqual(result.y, [])
+
+        # Missing keys are created once, so no appends are lost
+        def work():
+            for i in range(2000):
+                ad[i % 50].append(i)
+
+        ad = ConcurrentDefaultAttrDict(list)
+        run_threads(work)
+        self.assertEqual(sum(len(val) for val in ad.values()), 8 * 2000)
+        ad = ConcurrentDefaultAttrDict(int)
+        run_threads(lambda: [ad.add(i % 50) for i in range(2000)])
+        self.assertEqual(sum(ad.values()), 8 * 2000)
+
+    def test_structure(self):
+        ad = ConcurrentDefaultAttrDict(int, [('a', 1), ('b', 2), ('c', 3)])
+        ad.move_to_end('a')
+        self.assertEqual(list(ad), ['b', 'c', 'a'])
+        self.assertEqual(list(reversed(ad)), ['a', 'c', 'b'])
+        self.assertEqual(ad.pop('c'), 3)
+        self.assertEqual(ad.popitem(), ('a', 1))
+        self.assertEqual(ad.setdefault('d', 4), 4)
+        del ad.b
+        self.assertEqual(list(ad.items()), [('d', 4)])
+        ad.clear()
+        self.assertEqual(ad, {})
+
+    def test_lock_order(self):
+        # Reading missing keys while setting new keys does not deadlock
+        ad = ConcurrentDefaultAttrDict(int)
+
+        def read():
+            for i in range(5000):
+                ad['r%d' % i]
+
+        def write():
+            for i in range(5000):
+                ad['w%d' % i] = 1
+                ad.setdefault('s%d' % i, 1)
+
+        workers = [threading.Thread(target=func) for func in (read, write)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join(10)
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+        self.assertEqual(len(ad), 3 * 5000)
+
+    def test_update_delete_race(self):
+        # Updating keys while other threads delete them keeps the order in sync
+        ad = ConcurrentCounterAttrDict()
+        keys = ['k%d' % i for i in range(5)]
+
+        def work(index=itertools.count()):
+            delete = next(index) % 2
+            for i in range(3000):
+                key = keys[i % 5]
+                if not delete:
+                    ad.add(key)
+                    ad[key] = 1
+                elif i % 3:
+                    ad.pop(key, None)
+                elif i % 100:
+                    try:
+                        ad.popitem()
+                    except KeyError:
+                        pass
+                else:
+                    ad.clear()
+
+        # Switch threads often, to hit the race more reliably
+        interval = sys.getswitchinterval() if hasattr(sys, 'getswitchinterval') else None
+        if interval is not None:
+            sys.setswitchinterval(1e-6)
+        try:
+            run_threads(work)
+        finally:
+            if interval is not None:
+                sys.setswitchinterval(interval)
+        self.assertEqual(sorted(ad), sorted(dict.keys(ad)))
+        self.assertEqual(len(list(ad)), len(ad))
+        for key in list(ad):
+            del ad[key]
+        self.assertEqual(list(ad), [])
+
+
+class TestLRUAttrDict(unittest.TestCase):
+    def test_lru(self):
+        ad = LRUAttrDict(3)
+        ad.a, ad.b, ad.c = 1, 2, 3
+        self.assertEqual(ad.a, 1)
+        ad.d = 4
+        self.assertEqual(list(ad.items()), [('c', 3), ('a', 1), ('d', 4)])
+        with self.assertRaises(AttributeError):
+            ad.b
+        self.assertEqual(ad.get('b', 0), 0)
+        ad.c = 5
+        self.assertEqual(list(ad), ['a', 'd', 'c'])
+        self.assertEqual(ad.cache_info(), (1, 2, 1, 0, 3, 3))
+        self.assertEqual(ad.pop('d'), 4)
+        self.assertEqual(ad.cache_info().hits, 1)
+        for result in (ad.copy(), pickle.loads(pickle.dumps(ad))):
+            self.assertIs(type(result), LRUAttrDict)
+            self.assertEqual(list(result.items()), [('a', 1), ('c', 5)])
+            result.x, result.y = 1, 2
+            self.assertEqual(list(result), ['c', 'x', 'y'])
+            self.assertEqual(result.cache_info().evictions, 2)
+        self.assertEqual(ad.cache_info().evictions, 1)
+        unlimited = LRUAttrDict(None, [(i, i) for i in range(1000)])
+        self.assertEqual(unlimited.cache_info().currsize, 1000)
+
+    def test_approximate(self):
+        ad = LRUAttrDict(3, approximate=True)
+        ad.a, ad.b, ad.c = 1, 2, 3
+        self.assertEqual(ad.a, 1)
+        self.assertEqual(list(ad), ['a', 'b', 'c'])
+        # a was used, so b is evicted instead, and a moves to the end
+        ad.d = 4
+        self.assertEqual(list(ad), ['c', 'd', 'a'])
+        ad.e = 5
+        self.assertEqual(list(ad), ['d', 'a', 'e'])
+
+    def test_ttl(self):
+        class Clock(TTLAttrDict):
+            now = 0
+            __timer__ = staticmethod(lambda: Clock.now)
+
+        ad = Clock(10, 3)
+        ad.x = 1
+        Clock.now = 5
+        ad.y = 2
+        self.assertEqual(ad.x, 1)
+        Clock.now = 10
+        self.assertNotIn('x', ad)
+        self.assertEqual(list(ad), ['y'])
+        self.assertEqual(ad.get('x'), None)
+        Clock.now = 20
+        with self.assertRaises(KeyError):
+            ad['y']
+        ad.update(a=1, b=2, c=3, d=4)
+        self.assertEqual(list(ad), ['b', 'c', 'd'])
+        self.assertEqual(ad.cache_info(), (1, 2, 1, 2, 3, 3))
+        Clock.now = 30
+        ad.expire()
+        self.assertEqual(len(ad), 0)
+        # Copies restart the TTL
+        original = Clock(10, None, x=1)
+        Clock.now = 35
+        result = copy.copy(original)
+        self.assertEqual(list(result), ['x'])
+        Clock.now = 40
+        self.assertEqual(list(original), [])
+        self.assertEqual(list(result), ['x'])
+        self.assertEqual(list(pickle.loads(pickle.dumps(TTLAttrDict(10, x=1)))), ['x'])
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestArrayCounterAttrDict(unittest.TestCase):
+    def test_counter(self):
+        ad = ArrayCounterAttrDict()
+        self.assertEqual(ad.x, 0)
+        self.assertEqual(ad, {})
+        ad.x += 1
+        ad.y += 2
+        ad['z'] += 3
+        self.assertEqual(list(ad.items()), [('x', 1), ('y', 2), ('z', 3)])
+        self.assertEqual(ad.total(), 6)
+        del ad.y
+        self.assertEqual(list(ad.items()), [('x', 1), ('z', 3)])
+        with self.assertRaises(AttributeError):
+            del ad.y
+        result = pickle.loads(pickle.dumps(ad))
+        self.assertEqual(list(result.items()), [('x', 1), ('z', 3)])
+        self.assertEqual(ad.to_counter(), CounterAttrDict(x=1, z=3))
+        self.assertEqual(sorted(ad.elements()), ['x', 'z', 'z', 'z'])
+
+    def test_update_many(self):
+        keys = ['c', 'a', 'b', 'a', 'c', 'c']
+        for data in (keys, np.array(keys), [3, 1, 2, 1, 3, 3], np.array([3, 1, 2, 1, 3, 3])):
+            ad = ArrayCounterAttrDict()
+            ad.update_many(data)
+            self.assertEqual(list(ad.values()), [3, 2, 1])
+            ad.update_many(data, counts=[1, 2, 3, 4, 5, 6])
+            self.assertEqual(list(ad.values()), [15, 8, 4])
+        ad = ArrayCounterAttrDict(keys)
+        self.assertEqual(list(ad.items()), [('c', 3), ('a', 2), ('b', 1)])
+        ad.update({'d': 4}, a=1)
+        ad.subtract(['c'])
+        self.assertEqual(list(ad.items()), [('c', 2), ('a', 3), ('b', 1), ('d', 4)])
+        self.assertEqual(ad.most_common(2), [('d', 4), ('a', 3)])
+        self.assertEqual(ad.most_common(), [('d', 4), ('a', 3), ('c', 2), ('b', 1)])
+        self.assertEqual(ad.array.tolist(), [2, 3, 1, 4])
+
+    def test_most_common_ties(self):
+        # Ties, even at the cut-off, are in insertion order
+        rand = random.Random(1)
+        for trial in range(50):
+            ad = ArrayCounterAttrDict(rand.randrange(30) for i in range(100))
+            expected = sorted(ad.items(), key=lambda item: -item[1])
+            for n in (1, 3, 10, 29):
+                self.assertEqual(ad.most_common(n), expected[:n])
+
+    def test_arithmetic(self):
+        a = ArrayCounterAttrDict(x=3, y=1)
+        b = ArrayCounterAttrDict(y=2, z=1)
+        self.assertEqual(list((a + b).items()), [('x', 3), ('y', 3), ('z', 1)])
+        self.assertEqual(list((a - b).items()), [('x', 3)])
+        self.assertEqual(list((b - a).items()), [('y', 1), ('z', 1)])
+        self.assertEqual(a + {'x': 1}, {'x': 4, 'y': 1})
+
+
+@unittest.skipIf(SortedAttrDict is None, 'needs sortedcontainers')
+class TestSortedAttrDict(unittest.TestCase):
+    def test_sorted(self):
+        ad = SortedAttrDict(c=3, a=1)
+        ad.b = 2
+        ad['d'] = 4
+        self.assertEqual(list(ad), ['a', 'b', 'c', 'd'])
+        self.assertEqual(list(reversed(ad)), ['d', 'c', 'b', 'a'])
+        self.assertEqual(ad.b, 2)
+        self.assertEqual(list(ad.irange('b', 'c')), ['b', 'c'])
+        self.assertEqual(list(ad.irange('b', inclusive=(False, True), reverse=True)), ['d', 'c'])
+        self.assertEqual(ad.bisect('bb'), 2)
+        self.assertEqual(ad.bisect_left('b'), 1)
+        self.assertEqual(ad.bisect_right('b'), 2)
+        self.assertEqual(ad.index('c'), 2)
+        self.assertEqual(ad.peekitem(), ('d', 4))
+        self.assertEqual(ad.peekitem(1), ('b', 2))
+        del ad.b
+        self.assertEqual(ad.popitem(), ('d', 4))
+        self.assertEqual(ad.popitem(last=False), ('a', 1))
+        self.assertEqual(list(ad), ['c'])
+        self.assertRaises(NotImplementedError, ad.move_to_end, 'c')
+        ad = SortedAttrDict([(3, 'c'), (1, 'a'), (2, 'b')])
+        for copied in (ad.copy(), copy.copy(ad), pickle.loads(pickle.dumps(ad)), ad.snapshot()):
+            self.assertEqual(list(copied.items()), [(1, 'a'), (2, 'b'), (3, 'c')])
+            copied[0] = 'z'
+            self.assertEqual(copied.peekitem(0), (0, 'z'))
+        self.assertEqual(json.dumps(ad), '{"1": "a", "2": "b", "3": "c"}')
+        ad.clear()
+        self.assertEqual(list(ad.irange()), [])
+
+        # Keys that can't be compared aren't added
+        with self.assertRaises(TypeError):
+            ad.update([(1, 'a'), ('b', 2)])
+        self.assertEqual((len(ad), list(ad)), (0, []))
+        with self.assertRaises(ValueError):
+            ad.update((key, 1) if key != 'c' else int('x') for key in 'abc')
+        self.assertEqual(list(ad), ['a', 'b'])
+
+    def test_tree(self):
+        tree = SortedTree()
+        tree.z.y = 1
+        tree.a.c = 2
+        tree.set_path('a.b', 3)
+        self.assertIsInstance(tree.a, SortedTree)
+        self.assertEqual(list(tree), ['a', 'z'])
+        self.assertEqual(list(tree.a.items()), [('b', 3), ('c', 2)])
+        for copied in (pickle.loads(pickle.dumps(tree)), tree.snapshot()):
+            self.assertEqual(list(copied.a), ['b', 'c'])
+            copied.m.n = 1
+            self.assertEqual(list(copied), ['a', 'm', 'z'])
+            self.assertIsInstance(copied.m, SortedTree)
+
+    def test_counter(self):
+        counts = SortedCounterAttrDict()
+        for bucket in (1300, 1200, 1300, 1100):
+            counts[bucket] += 1
+        self.assertEqual(list(counts.items()), [(1100, 1), (1200, 1), (1300, 2)])
+        self.assertEqual(counts.most_common(1), [(1300, 2)])
+        self.assertEqual(counts.x, 0)
+        counts.subtract({1000: 1})
+        self.assertEqual(list(counts.irange(maximum=1200)), [1000, 1100, 1200])
+
 
 class TestTree(unittest.TestCase):
+    def test_exclude_keys(self):
+        'Names reserved by subclasses do not leak into other classes'
+        CounterAttrDict(x=1).most_common()
+        tree = Tree()
+        self.assertNotIn('__exclude_keys__', vars(tree))
+        self.assertIs(tree.default_factory, Tree)
+        ad = AttrDict()
+        ad.most_common = ad.default_factory = 1
+        self.assertEqual(ad, {'most_common': 1, 'default_factory': 1})
+
     def test_tree(self):
         tree = Tree()
         tree.x.y.z = 1
@@ -338,3 +1058,621 @@ class TestTree(unittest.TestCase):
 
         tree.a.b = None
         self.assertEqual(tree, {'x': {}, 'a': {'b': None}})
+
+        result = pickle.loads(pickle.dumps(tree, protocol=2))
+        self.assertEqual(result, tree)
+        result.p.q = 1
+        self.assertIsInstance(result.p, Tree)
+
+    def test_paths(self):
+        tree = Tree()
+        tree.set_path('a.b.c', 1)
+        tree.set_path(['a', 'b', 2], 2)
+        self.assertEqual(tree, {'a': {'b': {'c': 1, 2: 2}}})
+        self.assertIsInstance(tree.a.b, Tree)
+        self.assertEqual(tree.get_path('a.b.c'), 1)
+        self.assertEqual(tree.get_path(('a', 'b', 2)), 2)
+        self.assertEqual(tree.get_path('a/b', sep='/'), {'c': 1, 2: 2})
+        # Unicode paths are split too, on Python 2 as well
+        self.assertEqual(tree.get_path(u'a.b.c'), 1)
+
+        # Missing paths return the default without creating nodes
+        self.assertEqual(tree.get_path('a.x.y'), None)
+        self.assertEqual(tree.get_path('a.b.c.d', 0), 0)
+        self.assertEqual(tree, {'a': {'b': {'c': 1, 2: 2}}})
+
+        # Paths can run through other mappings
+        tree.p = {'q': AttrDict(r=1)}
+        self.assertEqual(tree.get_path('p.q.r'), 1)
+
+        tree = Tree()
+        tree.update_paths([('a.b.c', 1), ('a.b.d', 2), ('a.b', 3), ('a.b', {}), ('a.b.e', 4)])
+        tree.update_paths({'x.y': 5})
+        self.assertEqual(tree, {'a': {'b': {'e': 4}}, 'x': {'y': 5}})
+        with self.assertRaises(TypeError):
+            tree.update_paths([('x.y.z', 6)])
+
+    def test_snapshot(self):
+        tree = Tree()
+        tree.a.b.c = 1
+        tree.x.y = 2
+        tree.l = [1]
+        snap = tree.snapshot()
+        self.assertIsInstance(snap, Tree)
+        self.assertEqual(snap, tree)
+
+        # Changes to the snapshot don't affect the original
+        snap.a.b.c = 3
+        snap.a.d.e = 4
+        del snap.l
+        self.assertEqual(tree, {'a': {'b': {'c': 1}}, 'x': {'y': 2}, 'l': [1]})
+        self.assertEqual(snap, {'a': {'b': {'c': 3}, 'd': {'e': 4}}, 'x': {'y': 2}})
+        self.assertEqual(snap.get('x'), tree.x)
+        self.assertIsNot(snap.get('x'), tree.x)
+        # Unaccessed subtrees are shared
+        snap2 = snap.snapshot()
+        self.assertIs(dict.__getitem__(snap2, 'a'), dict.__getitem__(snap, 'a'))
+        snap2.a.b.c = 5
+        self.assertEqual((tree.a.b.c, snap.a.b.c, snap2.a.b.c), (1, 3, 5))
+
+        ad = DefaultAttrDict(list, [('x', AttrDict(y=[1]))])
+        snap = ad.snapshot()
+        snap.z.append(1)
+        self.assertEqual(snap.popitem(last=False), ('x', {'y': [1]}))
+        self.assertEqual(ad, {'x': {'y': [1]}})
+        result = pickle.loads(pickle.dumps(tree.snapshot()))
+        self.assertEqual(result, tree)
+        self.assertIs(type(result), Tree)
+
+        # New instances of the snapshot class, e.g. new nodes and copies, work too
+        snap = tree.snapshot()
+        snap.set_path('new.key', 1)
+        snap.update_paths({'a.b.f': 2})
+        self.assertEqual(snap.new.key, 1)
+        self.assertEqual(tree.get_path('new.key'), None)
+        self.assertEqual(tree.a.b, {'c': 1})
+        copied = snap.copy()
+        copied.a.b.c = 6
+        copied.extra.y = 1
+        self.assertEqual((tree.a.b.c, copied.a.b.c), (1, 6))
+        self.assertEqual(dict(type(snap).fromkeys('pq', 0)), {'p': 0, 'q': 0})
+
+        # Paths read through snapshots copy shared nodes too
+        snap = tree.snapshot()
+        snap.get_path('a.b').c = 7
+        snap.get_path(['x']).y = 8
+        snap.set_path('a.b.g', 9)
+        self.assertEqual(snap.get_path('a.b'), {'c': 7, 'g': 9})
+        self.assertEqual(snap.get_path('a.missing.key', 0), 0)
+        self.assertEqual(tree, {'a': {'b': {'c': 1}}, 'x': {'y': 2}, 'l': [1]})
+
+    def test_flatten(self):
+        tree = Tree()
+        tree.a.b = 1
+        tree.a.c.d = 2
+        tree.x = [3]
+        tree.a.e = {}
+        tree[1].y = 4
+        items = flatten(tree)
+        self.assertEqual(next(items), ('a.b', 1))
+        self.assertEqual(list(items), [('a.c.d', 2), ('a.e', {}), ('x', [3]), ('1.y', 4)])
+        self.assertEqual(dict(flatten(tree, sep='/'))['a/c/d'], 2)
+
+        result = unflatten(flatten(tree))
+        self.assertIsInstance(result.a.c, Tree)
+        self.assertEqual(result, unflatten(dict(flatten(tree))))
+        del tree[1]
+        del result['1']
+        self.assertEqual(result, tree)
+        result = unflatten([('a/b', 1), ('c', 2), ('a/d', 3)], cls=AttrDict, sep='/')
+        self.assertEqual(result, AttrDict([('a', AttrDict(b=1, d=3)), ('c', 2)]))
+        self.assertIsInstance(result.a, AttrDict)
+
+
+class TestInterner(unittest.TestCase):
+    def setUp(self):
+        self.rows = [AttrDict([('host', 'server%d' % (i % 3)), ('port', 8000 + i % 2),
+                               ('ratio', 0.5), ('flag', True)]) for i in range(10)]
+
+    def check(self, rows, table, values, shared=True):
+        self.assertEqual(rows, self.rows)
+        self.assertTrue(all(type(row) is AttrDict for row in rows))
+        # Keys are shared across rows. Values are shared if values=True
+        self.assertIs(list(rows[0])[0], list(rows[9])[0])
+        self.assertEqual(rows[0].host is rows[3].host, values)
+        # shared=True if the Interner shared strings that the parser didn't
+        self.assertEqual(table.hits > 0, shared)
+        self.assertEqual(table.saved > 0, shared)
+
+    def test_json(self):
+        text = json.dumps(self.rows)
+        for values in (True, False):
+            # json shares keys within a document, so only values are saved
+            table = Interner(values=values)
+            self.check(jsonutils.loads(text, intern=table), table, values, values)
+            table = Interner(values=values)
+            self.check(jsonutils.load(TextIO(text), intern=table), table, values, values)
+            # iter_load shares keys across lines, which json alone does not
+            lines = '\n'.join(json.dumps(row) for row in self.rows)
+            table = Interner(values=values)
+            self.check(list(jsonutils.iter_load(TextIO(lines), intern=table)), table, values)
+        table = Interner()
+        rows = json.loads(text, object_pairs_hook=table.hook(DictAttrDict))
+        self.assertIsInstance(rows[0], DictAttrDict)
+        self.assertEqual(rows, self.rows)
+
+    def test_yaml(self):
+        text = yaml.dump(self.rows)
+        for loader in (AttrDictYAMLLoader, AttrDictCSafeLoader):
+            for values in (True, False):
+                table = Interner(values=values)
+                self.check(yamlutils.load(text, Loader=loader, intern=table), table, values)
+        table = Interner()
+        docs = list(yamlutils.load_many([yaml.dump(row) for row in self.rows], intern=table))
+        self.check(docs, table, False)
+        table = Interner()
+        docs = list(yamlutils.iter_load(TextIO(yaml.dump_all(self.rows)), intern=table))
+        self.check(docs, table, False)
+        # Without an Interner, each key is a separate string
+        rows = yamlutils.load(text)
+        self.assertIsNot(list(rows[0])[0], list(rows[9])[0])
+        # Python tags are only loaded with an unsafe Loader
+        unsafe = 'a: !!python/object/apply:os.getcwd []'
+        with self.assertRaises(yaml.constructor.ConstructorError):
+            yamlutils.load(unsafe, intern=Interner())
+        self.assertEqual(yamlutils.load(unsafe, Loader=AttrDictYAMLLoader), {'a': os.getcwd()})
+
+    def test_values(self):
+        table = Interner(values=True, max_length=3)
+        # Numbers that are equal but of different types are not mixed up
+        self.assertIs(type(table.value(1.0)), float)
+        self.assertIs(type(table.value(1)), int)
+        self.assertIs(table.value(True), True)
+        self.assertEqual(table.key(1.0), 1.0)
+        # Only strings up to max_length are shared
+        short, long_value = 'ab', 'abcd'
+        self.assertIs(table.value(''.join(short)), table.value(''.join(short)))
+        self.assertIsNot(table.value(''.join(long_value)), table.value(''.join(long_value)))
+        self.assertEqual(len(table), 3)
+        # -0.0 equals 0.0, but keeps its sign
+        rows = jsonutils.loads('[{"a": 0.0}, {"a": -0.0}]', intern=Interner(values=True))
+        self.assertEqual(math.copysign(1, rows[0].a), 1)
+        self.assertEqual(math.copysign(1, rows[1].a), -1)
+        self.assertEqual(math.copysign(1, table.key(0.0)), 1)
+        self.assertEqual(math.copysign(1, table.key(-0.0)), -1)
+
+
+class TestMerge(unittest.TestCase):
+    def test_deep_merge(self):
+        a = AttrDict([('x', 1), ('y', AttrDict(z=[1], w=2))])
+        b = {'y': {'z': [2], 'v': {'u': 3}}, 't': 4}
+        result = deep_merge(a, b)
+        self.assertIs(result, a)
+        y = AttrDict([('z', [2]), ('w', 2), ('v', {'u': 3})])
+        self.assertEqual(a, AttrDict([('x', 1), ('y', y), ('t', 4)]))
+        # Mappings from b are copied, so changing a doesn't change b
+        a.y.v['u'] = 0
+        self.assertEqual(b['y']['v'], {'u': 3})
+
+        def merge(strategy):
+            return deep_merge(Tree(x=1, y=Tree(z=[1])), Tree(x=2, y=Tree(z=[2])), strategy)
+
+        self.assertEqual(merge('keep'), Tree(x=1, y=Tree(z=[1])))
+        self.assertEqual(merge('append'), Tree(x=2, y=Tree(z=[1, 2])))
+        self.assertEqual(merge(lambda old, new: new * 2), Tree(x=4, y=Tree(z=[2, 2])))
+        with self.assertRaises(ValueError):
+            merge('missing')
+
+    def test_diff_patch(self):
+        old = AttrDict([('x', 1), ('y', AttrDict([('z', 2), ('w', [3])])), ('v', AttrDict(u=1))])
+        new = AttrDict([('x', 1.0), ('y', AttrDict([('z', 2), ('t', 4)])), ('s', 5)])
+        delta = diff(old, new)
+        self.assertEqual(delta, [(('x', ), 1.0), (('v', ), ), (('s', ), 5),
+                                 (('y', 'w'), ), (('y', 't'), 4)])
+        self.assertEqual(patch(copy.deepcopy(old), delta), new)
+        self.assertEqual(diff(old, old), [])
+        self.assertEqual(diff(old, copy.deepcopy(old)), [])
+        # Reordered mappings are set as a whole
+        reordered = AttrDict([('y', old.y), ('x', 1), ('v', old.v)])
+        self.assertEqual(diff(old, reordered), [((), reordered)])
+        result = patch(copy.deepcopy(old), diff(old, reordered))
+        self.assertEqual(list(result), ['y', 'x', 'v'])
+        # Equal FrozenAttrDicts are skipped
+        self.assertEqual(diff(freeze(old), freeze(copy.deepcopy(old))), [])
+        self.assertEqual(diff(freeze(old), freeze(new)), delta)
+        # ... but not if a nested mapping is reordered
+        nested = AttrDict([('x', 1), ('y', AttrDict([('w', [3]), ('z', 2)])), ('v', old.v)])
+        self.assertEqual(diff(old, nested), [(('y', ), nested.y)])
+        self.assertEqual(diff(freeze(old), freeze(nested)), [(('y', ), freeze(nested.y))])
+        nested = AttrDict([('x', 1), ('y', AttrDict(z=2, w=[AttrDict(a=1, b=2)]))])
+        reordered = AttrDict([('x', 1), ('y', AttrDict(z=2, w=[AttrDict(b=2, a=1)]))])
+        self.assertNotEqual(diff(freeze(nested), freeze(reordered)), [])
+
+
+class TestFrozenAttrDict(unittest.TestCase):
+    def test_frozen(self):
+        tree = Tree()
+        tree.x.y = 1
+        tree.z = [1, {'a': 2}]
+        frozen = freeze(tree)
+        self.assertIsInstance(frozen, FrozenAttrDict)
+        self.assertEqual(frozen.x.y, 1)
+        self.assertEqual(frozen.z[1].a, 2)
+        self.assertEqual(list(frozen.keys()), ['x', 'z'])
+        self.assertEqual(str(frozen), "{'x': FrozenAttrDict([('y', 1)]), "
+                                      "'z': (1, FrozenAttrDict([('a', 2)]))}")
+        with self.assertRaises(AttributeError):
+            frozen.missing
+
+        # Frozen dicts can't be modified, but can be used as keys
+        for method in (lambda: setattr(frozen, 'x', 1), lambda: frozen.update(x=1),
+                       lambda: frozen.__setitem__('x', 1), lambda: delattr(frozen, 'x'),
+                       frozen.clear, frozen.popitem, lambda: frozen.__init__(x=2)):
+            with self.assertRaises(TypeError):
+                method()
+        self.assertEqual(frozen.x, {'y': 1})
+        self.assertEqual({frozen: 1}[freeze(tree)], 1)
+        self.assertEqual(frozen, pickle.loads(pickle.dumps(frozen)))
+        self.assertEqual(frozen, copy.deepcopy(frozen))
+        self.assertLess(sys.getsizeof(frozen), sys.getsizeof(AttrDict(frozen)))
+
+        # thaw() restores a mutable tree
+        thawed = thaw(frozen, Tree)
+        self.assertEqual(thawed, tree)
+        self.assertIsInstance(thawed.x, Tree)
+        thawed.p.q = 1
+        self.assertEqual(thaw(frozen), {'x': {'y': 1}, 'z': [1, {'a': 2}]})
+
+    def test_order(self):
+        'Keys keep their order, even on Pythons whose dicts do not'
+        keys = ['z', 'a', 'm', 'b', 'y']
+        frozen = freeze(AttrDict((key, AttrDict(zip(keys, keys))) for key in keys))
+        for copied in (frozen, pickle.loads(pickle.dumps(frozen)), copy.deepcopy(frozen)):
+            self.assertEqual(list(copied), keys)
+            self.assertEqual(list(copied.z.items()), list(zip(keys, keys)))
+            self.assertEqual(list(copied.values())[0], frozen.z)
+        self.assertEqual(list(thaw(frozen)), keys)
+
+
+class TestChainAttrDict(unittest.TestCase):
+    def test_chain(self):
+        defaults = Tree()
+        defaults.db.host = 'localhost'
+        defaults.db.port = 5432
+        defaults.name = 'app'
+        env = AttrDict(db=AttrDict(port=6543), debug=True)
+        tenant = Tree()
+        conf = ChainAttrDict(tenant, env, defaults)
+
+        self.assertEqual(conf.db.port, 6543)
+        self.assertEqual(conf.db.host, 'localhost')
+        self.assertEqual(conf['name'], 'app')
+        self.assertEqual(list(conf), ['db', 'name', 'debug'])
+        self.assertEqual(len(conf), 3)
+        self.assertEqual(conf, {'db': {'host': 'localhost', 'port': 6543},
+                                'name': 'app', 'debug': True})
+        self.assertIsInstance(conf.db, ChainAttrDict)
+        # Lookups don't create nodes in Tree layers
+        self.assertEqual(tenant, {})
+        with self.assertRaises(AttributeError):
+            conf.missing
+        self.assertFalse('missing' in conf)
+        self.assertEqual(conf.get('missing', 1), 1)
+
+        # Writes go to the first layer, and changes to layers are visible
+        conf.name = 'tenant'
+        defaults.db.user = 'admin'
+        self.assertEqual((conf.name, tenant.name, defaults.name), ('tenant', 'tenant', 'app'))
+        self.assertEqual(conf.db.user, 'admin')
+        del conf.name
+        self.assertEqual(conf.name, 'app')
+        with self.assertRaises(KeyError):
+            del conf['debug']
+
+        # A non-mapping value in an earlier layer hides mappings in later ones
+        env.db = None
+        self.assertEqual(conf.db, None)
+        self.assertEqual(conf.parents.maps, [env, defaults])
+        self.assertEqual(conf.new_child(AttrDict(x=1)).x, 1)
+        self.assertEqual(ChainAttrDict(), {})
+
+    def test_nested_writes(self):
+        'Writes to nested mappings go to the first layer, not the layer that has them'
+        defaults = AttrDict(db=AttrDict(host='localhost', opts=AttrDict(ssl=False)))
+        env = AttrDict()
+        conf = ChainAttrDict(env, defaults)
+        conf.db.port = 1
+        self.assertEqual(env, {'db': {'port': 1}})
+        self.assertEqual((conf.db.port, conf.db.host), (1, 'localhost'))
+        conf.db.opts.ssl = True
+        self.assertEqual(env.db.opts, {'ssl': True})
+        self.assertEqual(defaults, {'db': {'host': 'localhost', 'opts': {'ssl': False}}})
+        # Reads and failed deletes don't add anything
+        tenant = Tree()
+        conf = ChainAttrDict(tenant, env, defaults)
+        self.assertEqual(conf.db.opts.ssl, True)
+        with self.assertRaises(KeyError):
+            del conf.db.host
+        self.assertEqual(tenant, {})
+        # Views taken before the first write share the new mapping
+        first, second = conf.db, conf.db
+        first.x = 1
+        second.y = 2
+        self.assertEqual(tenant, {'db': {'x': 1, 'y': 2}})
+
+
+class TestSharedAttrDict(unittest.TestCase):
+    def setUp(self):
+        self.tree = Tree()
+        self.tree.db.host = 'localhost'
+        self.tree.db.port = 5432
+        self.tree.db.ratio = 0.5
+        self.tree.hosts = [AttrDict(name='localhost'), None]
+        self.tree[1] = {'flag': True, 'off': False, 'big': 2 ** 70}
+        self.tree.empty = {}
+
+    def check(self, shared):
+        self.assertEqual(shared, self.tree)
+        self.assertEqual(list(shared), ['db', 'hosts', 1, 'empty'])
+        self.assertEqual(shared.db.host, 'localhost')
+        self.assertEqual(shared[1]['big'], 2 ** 70)
+        self.assertIsInstance(shared.db, sharedutils.SharedAttrDict)
+        self.assertIs(shared.db, shared.db)
+        self.assertEqual(len(shared.db), 3)
+        self.assertTrue('port' in shared.db)
+        with self.assertRaises(AttributeError):
+            shared.missing
+        with self.assertRaises(TypeError):
+            shared.db = 1
+        result = shared.to_attrdict(Tree)
+        self.assertEqual(result, self.tree)
+        self.assertIsInstance(result.db, Tree)
+
+    def test_buffer(self):
+        self.check(sharedutils.loads(sharedutils.dumps(self.tree)))
+        # Text and byte strings load as the same type
+        shared = sharedutils.loads(sharedutils.dumps({u'text': u'caf\xe9', 'bytes': b'\xff'}))
+        self.assertEqual(shared[u'text'], u'caf\xe9')
+        self.assertIs(type(shared[u'text']), type(u''))
+        self.assertEqual(shared['bytes'], b'\xff')
+        self.assertIs(type(shared['bytes']), bytes)
+        with self.assertRaises(ValueError):
+            sharedutils.loads(b'\0' * 32)
+
+    @unittest.skipIf(sys.version_info < (3, ), 'mmap is not a buffer on Python 2')
+    def test_file(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            sharedutils.dump(self.tree, path)
+            shared = sharedutils.load(path)
+            self.check(shared)
+            del shared
+        finally:
+            os.remove(path)
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'needs multiprocessing.shared_memory')
+    def test_shared_memory(self):
+        shm = sharedutils.share(self.tree)
+        try:
+            shared = sharedutils.attach(shm.name)
+            self.check(shared)
+            del shared
+            # Nested values stay valid after the root is gone
+            db = sharedutils.attach(shm.name).db
+            gc.collect()
+            self.assertEqual(db.host, 'localhost')
+            del db
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'needs multiprocessing.shared_memory')
+    def test_worker_exit(self):
+        # A worker that attaches and exits must not unlink the parent's block
+        import subprocess
+        shm = sharedutils.share(self.tree)
+        try:
+            code = 'from orderedattrdict import sharedutils; sharedutils.attach(%r)' % shm.name
+            subprocess.check_call([sys.executable, '-c', code])
+            shared = sharedutils.attach(shm.name)
+            self.check(shared)
+            del shared
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'needs multiprocessing.shared_memory')
+    def test_creator_attach(self):
+        # Attaching in the creating process keeps its tracker registration, so
+        # unlink() doesn't raise an error in the tracker
+        import subprocess
+        code = ('from orderedattrdict import sharedutils\n'
+                'shm = sharedutils.share({"a": {"b": 1}})\n'
+                'assert sharedutils.attach(shm.name).a.b == 1\n'
+                'shm.close()\n'
+                'shm.unlink()\n')
+        proc = subprocess.Popen([sys.executable, '-c', code], stderr=subprocess.PIPE)
+        err = proc.communicate()[1].decode('utf-8')
+        self.assertEqual(proc.returncode, 0)
+        self.assertNotIn('Error', err)
+
+
+class TestRecordSchema(unittest.TestCase):
+    def test_records(self):
+        User = RecordSchema(['id', 'name', 'keys'])
+        users = list(User.from_rows([(1, 'a', 'x'), (2, 'b', 'y')]))
+        user = users[0]
+        self.assertIsInstance(user, AttrRecord)
+        self.assertEqual(user.name, 'a')
+        self.assertEqual(user['id'], 1)
+        self.assertTrue(callable(user.keys))
+        self.assertEqual(list(user), ['id', 'name', 'keys'])
+        self.assertEqual(list(reversed(user)), ['keys', 'name', 'id'])
+        self.assertEqual(user.values(), (1, 'a', 'x'))
+        self.assertEqual(user, {'id': 1, 'name': 'a', 'keys': 'x'})
+        self.assertTrue('name' in user)
+        self.assertFalse('a' in user)
+        self.assertEqual(user.get('missing', 0), 0)
+        self.assertEqual(str(user), "{'id': 1, 'name': 'a', 'keys': 'x'}")
+        with self.assertRaises(AttributeError):
+            user.missing
+        with self.assertRaises(TypeError):
+            user.name = 'c'
+
+        ad = user.to_attrdict()
+        self.assertIsInstance(ad, AttrDict)
+        self.assertEqual(list(ad.items()), list(user.items()))
+        self.assertIsInstance(user.to_attrdict(Tree), Tree)
+
+        # Records pickle, and rows share one schema
+        result = pickle.loads(pickle.dumps(users))
+        self.assertEqual(result, users)
+        self.assertIs(type(result[0]), type(result[1]))
+        self.assertLess(sys.getsizeof(user), sys.getsizeof(ad))
+
+        with self.assertRaises(ValueError):
+            User([1, 'a'])
+        with self.assertRaises(ValueError):
+            RecordSchema(['id', 'id'])
+
+
+# Timing tests compare speeds, which varies on shared machines like CI. Opt in
+@unittest.skipUnless(os.environ.get('ORDEREDATTRDICT_PERF'), 'set ORDEREDATTRDICT_PERF=1')
+class TestPerformance(unittest.TestCase):
+    def best(self, stmt, number=100000, **namespace):
+        '''Return the best time to run stmt (a callable or a statement that uses
+        names from namespace) number times'''
+        if not callable(stmt):
+            # timeit.repeat(globals=) needs Python 3.5+. Compile stmt into a function
+            exec(compile('def stmt():\n    ' + stmt, '<timeit>', 'exec'), namespace)
+            stmt = namespace['stmt']
+        return min(timeit.repeat(stmt, number=number, repeat=5))
+
+    def test_attribute_access_speed(self):
+        'ad.x costs little more than the cheapest possible __getattr__ fallback'
+        class Floor(OrderedDict):
+            def __getattr__(self, name):
+                return 1
+
+        ad, floor = AttrDict(x=1), Floor(x=1)
+        self.assertLess(self.best('ad.x', ad=ad), 3 * self.best('floor.x', floor=floor))
+
+    def test_concurrent_speed(self):
+        'Striped add() across threads is about as fast as one global lock, and exact'
+        keys = ['k%d' % i for i in range(100)]
+        lock = threading.Lock()
+
+        def striped():
+            ad = ConcurrentCounterAttrDict()
+            run_threads(lambda: [ad.add(keys[i % 100]) for i in range(2000)])
+            self.assertEqual(sum(ad.values()), 16000)
+
+        def single():
+            ad = CounterAttrDict()
+
+            def work():
+                for i in range(2000):
+                    with lock:
+                        ad[keys[i % 100]] += 1
+
+            run_threads(work)
+
+        self.assertLess(self.best(striped, number=1), 3 * self.best(single, number=1))
+
+    def test_lru_speed(self):
+        'LRUAttrDict hits, which reorder keys, cost at most 4x an AttrDict lookup'
+        ad, lru = AttrDict(x=1, y=2), LRUAttrDict(10, x=1, y=2)
+        self.assertLess(self.best('lru.x; lru.y', number=20000, lru=lru),
+                        4 * self.best('ad.x; ad.y', number=20000, ad=ad))
+
+    def test_indexed_speed(self):
+        'IndexedAttrDict.at() does not walk the keys'
+        ad = IndexedAttrDict((str(i), i) for i in range(20000))
+        self.assertLess(self.best('ad.at(10000)', number=100, ad=ad),
+                        self.best('next(islice(ad, 10000, None))', number=100, ad=AttrDict(ad),
+                                  islice=itertools.islice) / 20)
+
+    def test_fifo_delete_speed(self):
+        'Deleting the first key does not slow down as the dict grows'
+        def fifo(size):
+            ad = AttrDict((key, key) for key in range(size))
+            return self.best('del ad[next(iter(ad))]; ad[key] = 1', number=1000,
+                             ad=ad, key=-1)
+
+        self.assertLess(fifo(20000), 3 * fifo(1000))
+
+    def test_lru_insert_speed(self):
+        'Inserting into a full LRUAttrDict does not slow down as maxsize grows'
+        def insert(maxsize, **kwargs):
+            ad = LRUAttrDict(maxsize, ((key, key) for key in range(maxsize)), **kwargs)
+            return self.best('key[0] -= 1; ad[key[0]] = 1', number=10000, ad=ad, key=[-1])
+
+        self.assertLess(insert(100000), 3 * insert(1000))
+        self.assertLess(insert(100000, approximate=True), 3 * insert(1000, approximate=True))
+
+    def test_tree_build_speed(self):
+        'Tree nodes cost little more than creating the AttrDicts by hand'
+        def build_tree():
+            tree = Tree()
+            for i in range(100):
+                node = tree[i]
+                for j in range(100):
+                    node[j].leaf = 1
+
+        def build_attrdict():
+            tree = AttrDict()
+            for i in range(100):
+                node = tree[i] = AttrDict()
+                for j in range(100):
+                    node[j] = AttrDict(leaf=1)
+
+        self.assertLess(self.best(build_tree, number=1), 2 * self.best(build_attrdict, number=1))
+
+    def test_diff_speed(self):
+        'diff() skips subtrees shared by both trees'
+        old = AttrDict(('a%d' % i, AttrDict(('b%d' % j, AttrDict(c=j, d=[j])) for j in range(20)))
+                       for i in range(200))
+        new = copy.deepcopy(old)
+        new.a5.b3.c = 0
+        shared = AttrDict(old)
+        shared.a5 = AttrDict(old.a5)
+        shared.a5.b3 = AttrDict(c=0, d=[3])
+        self.assertEqual(diff(old, new), diff(old, shared))
+        shared_time = self.best('diff(old, shared)', number=1, diff=diff, old=old, shared=shared)
+        full_time = self.best('diff(old, new)', number=1, diff=diff, old=old, new=new)
+        self.assertLess(shared_time, full_time / 10)
+
+    @unittest.skipIf(np is None, 'needs numpy')
+    def test_array_counter_speed(self):
+        'update_many() is much faster than counting keys one by one'
+        keys = np.random.randint(0, 1000, 20000)
+
+        def loop():
+            ad = CounterAttrDict()
+            for key in keys.tolist():
+                ad[key] += 1
+
+        self.assertLess(self.best(lambda: ArrayCounterAttrDict().update_many(keys), number=1),
+                        self.best(loop, number=1) / 10)
+
+    @unittest.skipIf(SortedAttrDict is None, 'needs sortedcontainers')
+    def test_sorted_speed(self):
+        'Keeping keys sorted is faster than sorting them on each read'
+        random.seed(0)
+        keys = [random.randrange(10 ** 6) for i in range(5000)]
+
+        def run(ad, read):
+            for i, key in enumerate(keys):
+                ad[key] = i
+                if i % 100 == 0:
+                    read(ad)
+
+        def sort_on_read():
+            run(AttrDict(), lambda ad: [key for key in sorted(ad) if 1000 <= key <= 50000])
+
+        def sorted_attrdict():
+            run(SortedAttrDict(), lambda ad: list(ad.irange(1000, 50000)))
+
+        self.assertLess(self.best(sorted_attrdict, number=1),
+                        self.best(sort_on_read, number=1) / 2)